@@ -0,0 +1,99 @@
+import torch
+import queue
+import atexit
+import threading
+
+
+#Epoch-based minibatch sampler: one permutation per epoch, contiguous slices of it per minibatch
+class EpochSampler():
+	#-----------------------
+	# Constructor
+	#-----------------------
+	def __init__(self, tensors, mb_size=256, device="cuda:0", on_device=True, n_prefetch=0):
+		#tensors   : list of (n, ...) arrays sharing the first dimension
+		#on_device : keep the whole dataset on device, else in (pinned) host memory
+		#n_prefetch: minibatches prepared ahead by a background thread (0 = none)
+		self.mb_size   = mb_size
+		self.device    = torch.device(device)
+		self.on_device = on_device
+		self.store_device = self.device if on_device else torch.device("cpu")
+
+		self.data = [torch.tensor(x, dtype=torch.float32, device=self.store_device) for x in tensors]
+		if not on_device and self.device.type == "cuda":
+			self.data = [x.pin_memory() for x in self.data]
+
+		self.n       = len(self.data[0])
+		self.n_batch = self.n // mb_size
+		self.epoch   = 0
+		self.pos     = self.n_batch
+		self.perm    = None
+
+		assert self.n_batch > 0, "dataset smaller than one minibatch"
+
+		#Background producer (stopped before interpreter shutdown)
+		self.queue = None
+		if n_prefetch > 0:
+			self.queue   = queue.Queue(maxsize=n_prefetch)
+			self.stopped = threading.Event()
+			self.thread  = threading.Thread(target=self.produce, daemon=True)
+			self.thread.start()
+			atexit.register(self.close)
+
+	#-----------------------
+	# Indices of the next minibatch (reshuffle at the start of each epoch)
+	#-----------------------
+	def next_indices(self):
+		if self.pos == self.n_batch:
+			self.perm   = torch.randperm(self.n, device=self.store_device)
+			self.pos    = 0
+			self.epoch += 1
+
+		idx = self.perm[self.pos*self.mb_size : (self.pos+1)*self.mb_size]
+		self.pos += 1
+
+		return idx
+
+	#-----------------------
+	# Gather a minibatch & move it to the training device
+	#-----------------------
+	def gather(self, idx):
+		batch = [x[idx] for x in self.data]
+
+		if not self.on_device:
+			if self.device.type == "cuda":
+				batch = [b.pin_memory() for b in batch]
+
+			batch = [b.to(self.device, non_blocking=True) for b in batch]
+
+		return batch
+
+	#-----------------------
+	# Background producer loop
+	#-----------------------
+	def produce(self):
+		while not self.stopped.is_set():
+			batch = self.gather(self.next_indices())
+
+			while not self.stopped.is_set():
+				try:
+					self.queue.put(batch, timeout=0.1)
+					break
+				except queue.Full:
+					pass
+
+	#-----------------------
+	# Stop the background producer
+	#-----------------------
+	def close(self):
+		if self.queue is not None:
+			self.stopped.set()
+			self.thread.join()
+
+	#-----------------------
+	# Sample a minibatch
+	#-----------------------
+	def sample(self):
+		if self.queue is not None:
+			return self.queue.get()
+
+		return self.gather(self.next_indices())
@@ -2,23 +2,16 @@ import sys
 sys.path.insert(0, "..")
 
 from model import PolicyNet
+from batch_sampler import EpochSampler
 import torch
 import os
 import time
 import circle_env
+import traj_store
 import numpy as np
 import pickle as pkl
 
 
-#-----------------------
-# Sample a batch
-#-----------------------
-def sample_batch(s_traj, a_traj, mb_size=256):
-	rand_idx = np.arange(len(s_traj))
-	np.random.shuffle(rand_idx)
-
-	return s_traj[rand_idx[:mb_size]], a_traj[rand_idx[:mb_size]]
-
 #-----------------------
 # Main
 #-----------------------
@@ -34,6 +27,8 @@ def main():
 	save_dir    = "./save"
 	device      = "cuda:0" if torch.cuda.is_available() else "cpu"
 	expert_path = "../expert_traj.pkl"
+	data_on_device = True
+	n_prefetch  = 0
 
 	#Create environment
 	#----------------------------
@@ -43,10 +38,17 @@ def main():
 
 	#Load expert trajectories
 	#----------------------------
-	if os.path.exists(expert_path):
-		s_traj, a_traj = pkl.load(open(expert_path, "rb"))
-		s_traj = np.concatenate(s_traj, 0)
-		a_traj = np.concatenate(a_traj, 0)
+	if traj_store.exists(expert_path):
+		store  = traj_store.load(expert_path)
+		s_traj = store.data[:, :store.s_dim]
+		a_traj = store.data[:, store.s_dim:]
+		sampler = EpochSampler(
+			[s_traj, a_traj],
+			mb_size,
+			device=device,
+			on_device=data_on_device,
+			n_prefetch=n_prefetch
+		)
 	else:
 		print("ERROR: No expert trajectory file found")
 		sys.exit(1)
@@ -76,11 +78,11 @@ def main():
 
 	for it in range(start_it, n_iter):
 		#Train
-		mb_obs, mb_actions  = sample_batch(s_traj, a_traj, mb_size)
+		mb_obs, mb_actions  = sampler.sample()
 		mb_a_logps, mb_ents = policy_net.evaluate(
-			torch.tensor(mb_obs, dtype=torch.float32, device=device), 
-			torch.tensor(mb_actions, dtype=torch.float32, device=device),
-			torch.tensor(np.random.randn(mb_size, c_dim), dtype=torch.float32, device=device)
+			mb_obs, 
+			mb_actions,
+			torch.randn((mb_size, c_dim), device=device)
 		)
 		loss = -mb_a_logps.mean()
 
@@ -90,8 +92,8 @@ def main():
 
 		#Print the result
 		if it % disp_step == 0:
-			print("[{:5d} / {:5d}] Elapsed time = {:.2f}, loss = {:.6f}".format(
-				it, n_iter, time.time() - t_start, loss.item())
+			print("[{:5d} / {:5d}] Elapsed time = {:.2f}, epoch = {:d}, loss = {:.6f}".format(
+				it, n_iter, time.time() - t_start, sampler.epoch, loss.item())
 			)
 
 		#Save model
@@ -2,6 +2,8 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import math
+import torch.nn.functional as F
 from distrib import Categorical, DiagGaussian
 from utils import init
 
@@ -11,7 +13,7 @@ class PolicyNet(nn.Module):
 	#-----------------------
 	# Constructor
 	#-----------------------
-	def __init__(self, s_dim, a_dim, c_dim, conti=False):
+	def __init__(self, s_dim, a_dim, c_dim, conti=False, fast=False):
 		super(PolicyNet, self).__init__()
 		self.conti = conti
 
@@ -29,9 +31,9 @@ class PolicyNet(nn.Module):
 		)
 
 		if conti:
-			self.dist = DiagGaussian(128, a_dim)
+			self.dist = DiagGaussian(128, a_dim, fast=fast)
 		else:
-			self.dist = Categorical(128, a_dim)
+			self.dist = Categorical(128, a_dim, fast=fast)
 
 	#-----------------------
 	# Forward
@@ -108,6 +110,65 @@ class ValueNet(nn.Module):
 
 		return value[:, 0]
 
+#Policy & value networks packed into grouped matrices for rollouts (no gradients)
+class RolloutModule():
+	#-----------------------
+	# Pack the current weights of the policy & value networks
+	#-----------------------
+	@torch.no_grad()
+	def pack(self, policy_net, value_net):
+		#Layer 1: policy rows on top of value rows
+		#(a value network without code input gets zero weights on the code columns)
+		p1, p2 = policy_net.main[0], policy_net.main[2]
+		v1, v2 = value_net.main[0], value_net.main[2]
+		w1_v   = F.pad(v1.weight, (0, p1.in_features - v1.in_features))
+
+		self.w1 = torch.cat([p1.weight, w1_v], 0)
+		self.b1 = torch.cat([p1.bias, v1.bias], 0)
+
+		#Layer 2 & heads: block diagonal
+		self.w2 = torch.block_diag(p2.weight, v2.weight)
+		self.b2 = torch.cat([p2.bias, v2.bias], 0)
+
+		self.conti = policy_net.conti
+		head = policy_net.dist.fc_mean if self.conti else policy_net.dist.linear[0]
+
+		self.w3 = torch.block_diag(head.weight, value_net.fc_v.weight)
+		self.b3 = torch.cat([head.bias, value_net.fc_v.bias], 0)
+
+		if self.conti:
+			self.a_dim  = head.out_features
+			self.logstd = policy_net.dist.logstd._bais.view(1, -1).clone()
+
+	#-----------------------
+	# Sample actions & evaluate values
+	#-----------------------
+	@torch.no_grad()
+	def __call__(self, ob, c):
+		#Same outputs as policy_net(ob, c) and value_net(ob[, c])
+		h   = F.relu(F.linear(torch.cat((ob, c), 1), self.w1, self.b1))
+		h   = F.relu(F.linear(h, self.w2, self.b2))
+		out = F.linear(h, self.w3, self.b3)
+		value = out[:, -1]
+
+		#Diagonal Gaussian
+		if self.conti:
+			mean   = out[:, :self.a_dim]
+			logstd = self.logstd.expand_as(mean)
+
+			eps    = torch.randn_like(mean)
+			action = mean + eps*logstd.exp()
+			a_logp = (-0.5*eps.pow(2) - logstd - 0.5*math.log(2*math.pi)).sum(-1)
+
+			return action, a_logp, value
+
+		#Categorical (the head's softmax output is used as logits)
+		log_p  = F.log_softmax(F.softmax(out[:, :-1], 1), 1)
+		action = torch.multinomial(log_p.exp(), 1)
+		a_logp = log_p.gather(1, action)[:, 0]
+
+		return action[:, 0], a_logp, value
+
 
 #Discriminator Network
 class DiscriminatorNet(nn.Module):
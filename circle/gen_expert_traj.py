@@ -1,77 +1,145 @@
 import math
+import argparse
 import numpy as np
 import pickle as pkl
-from circle_env import CircleEnv
+import multiprocessing as mp
+import traj_store
+from circle_env import BatchedCircleEnv, s_dim, a_dim
 from tqdm import tqdm
 
 
+#Expert modes: radius, clockwise, upper circle
+rs = [0.1, 0.4, 0.3]
+cs = [True, True, False]
+us = [True, True, False]
+
+
 #-----------------------
 # Circle equation
 #-----------------------
 def circle(theta, r):
-	return r*math.cos(theta), r*math.sin(theta)
+	return r*np.cos(theta), r*np.sin(theta)
 
 
 #-----------------------
-# Expert policy step
+# Expert policy step (batched)
 #-----------------------
 def policy_step(p, r, up=True, clockwise=True):
+	#p      : (n, 2)
+	#actions: (n, 2)
 	if up:
 		offset = r
 	else:
 		offset = -r
 
 	if clockwise:
-		theta = math.atan2(p[1]-offset, p[0]) + 2 * math.asin(0.005 / r)
+		theta = np.arctan2(p[:, 1]-offset, p[:, 0]) + 2 * math.asin(0.005 / r)
 	else:
-		theta = math.atan2(p[1]-offset, p[0]) - 2 * math.asin(0.005 / r)
+		theta = np.arctan2(p[:, 1]-offset, p[:, 0]) - 2 * math.asin(0.005 / r)
 
-	p_tar = circle(theta, r)
-	dx    = p_tar[0] - p[0]
-	dy    = p_tar[1] - p[1] + offset
-	norm  = math.sqrt(dx*dx + dy*dy)
+	x_tar, y_tar = circle(theta, r)
+	d    = np.stack([x_tar - p[:, 0], y_tar - p[:, 1] + offset], 1)
+	norm = np.sqrt((d*d).sum(1, keepdims=True))
 
-	return [dx / norm, dy / norm] if norm > 1e-8 else [0, 0]
+	return np.where(norm > 1e-8, d / np.maximum(norm, 1e-8), 0.0)
 
 
 #-----------------------
-# Main
+# Expert policy of a mode
 #-----------------------
-def main():
-	env       = CircleEnv()
-	rs        = [0.1, 0.4, 0.3]
-	cs        = [True, True, False]
-	us        = [True, True, False]
-	n_episode = 1024
-	s_traj    = []
-	a_traj    = []
-	idx       = 0
+def expert_policy(state, n=0):
+	return policy_step(state[:, -2:], rs[n], up=us[n], clockwise=cs[n])
+
+
+#-----------------------
+# Simulate a chunk of episodes of one mode together
+#-----------------------
+def run_chunk(task):
+	mode, n_episode, seed, sigma1, sigma2, max_step = task
+	np.random.seed(seed)
+	env = BatchedCircleEnv(n_episode, sigma1=sigma1, sigma2=sigma2, max_step=max_step)
+
+	#states : (max_step, n_episode, s_dim)
+	#actions: (max_step, n_episode, a_dim)
+	#lengths: (n_episode)
+	states  = np.zeros((max_step, n_episode, s_dim), dtype=np.float32)
+	actions = np.zeros((max_step, n_episode, a_dim), dtype=np.float32)
+	lengths = np.zeros((n_episode), dtype=np.int64)
+	alive   = np.ones((n_episode), dtype=bool)
+	obs     = env.reset()
+
+	for t in range(max_step):
+		action = expert_policy(obs, mode)
 
-	for i in range(len(rs)):
-		print("r = {:.2f}".format(rs[i]))
+		#The env moves along +x on a zero action, record what was executed
+		action[(action == 0).all(1)] = [1.0, 0.0]
 
-		for j in tqdm(range(1024)):
-			state = env.reset()
-			s_traj.append([])
-			a_traj.append([])
+		states[t]  = obs
+		actions[t] = action
+		lengths[alive] += 1
 
-			while True:
-				#env.render()
-				action = policy_step(state[-2:], rs[i], up=us[i], clockwise=cs[i])
-				
-				s_traj[idx].append(state)
-				a_traj[idx].append(action)
+		#Finished episodes are auto-reset by the env and no longer recorded
+		obs, rewards, dones, info = env.step(action)
+		alive &= ~dones
+
+		if not alive.any():
+			break
+
+	#data: (sum of lengths, s_dim+a_dim) episode after episode
+	valid = np.arange(max_step)[None, :] < lengths[:, None]
+	data  = np.concatenate([states, actions], 2).transpose(1, 0, 2)[valid]
+
+	return data, lengths
+
+
+#-----------------------
+# Main
+#-----------------------
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--n_episode", type=int, default=1024, help="episodes per expert mode")
+	parser.add_argument("--sigma1", type=float, default=0.01, help="noise of the start position")
+	parser.add_argument("--sigma2", type=float, default=0.0005, help="noise of each step")
+	parser.add_argument("--max_step", type=int, default=512)
+	parser.add_argument("--seed", type=int, default=None)
+	parser.add_argument("--n_proc", type=int, default=1, help="processes simulating chunks in parallel")
+	parser.add_argument("--chunk", type=int, default=1024, help="episodes simulated together")
+	parser.add_argument("--out", default="./expert_traj.pkl")
+	parser.add_argument("--no_pkl", action="store_true", help="only write the trajectory store")
+	args = parser.parse_args()
+
+	#Chunks with their own seeds (the result does not depend on n_proc)
+	#----------------------------
+	tasks = []
+	for mode in range(len(rs)):
+		for start in range(0, args.n_episode, args.chunk):
+			tasks.append([mode, min(args.chunk, args.n_episode - start)])
+
+	seeds = np.random.SeedSequence(args.seed).spawn(len(tasks))
+	tasks = [(mode, n, int(seed.generate_state(1)[0]), args.sigma1, args.sigma2, args.max_step) for (mode, n), seed in zip(tasks, seeds)]
+
+	if args.n_proc > 1:
+		with mp.Pool(args.n_proc) as pool:
+			results = list(tqdm(pool.imap(run_chunk, tasks), total=len(tasks)))
+	else:
+		results = [run_chunk(task) for task in tqdm(tasks)]
 
-				state, reward, done, info = env.step(action)
+	#Trajectory store (+ the (s_traj, a_traj) pickle)
+	#----------------------------
+	lengths = np.concatenate([lens for data, lens in results])
+	store   = traj_store.TrajectoryStore(
+		np.concatenate([data for data, lens in results]),
+		np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+		np.concatenate([np.full(len(lens), task[0], dtype=np.int64) for (data, lens), task in zip(results, tasks)]),
+		s_dim
+	)
 
-				if done:
-					s_traj[idx] = np.array(s_traj[idx], dtype=np.float32)
-					a_traj[idx] = np.array(a_traj[idx], dtype=np.float32)
-					idx += 1
-					break
+	if not args.no_pkl:
+		pkl.dump((store.s_traj(), store.a_traj()), open(args.out, "wb"))
 
-	pkl.dump((s_traj, a_traj), open("./expert_traj.pkl", "wb"))
+	traj_store.save(store, traj_store.store_path(args.out))
+	print("{} trajectories, {} frames".format(len(store), len(store.data)))
 
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()
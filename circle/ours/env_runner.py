@@ -1,49 +1,11 @@
 import torch
 import numpy as np
-from collections import deque
-
-
-#-----------------------
-# Compute discounted return
-#-----------------------
-def compute_discounted_return(rewards, dones, last_values, last_dones, gamma=0.99):
-	returns = np.zeros_like(rewards)
-	n_step  = len(rewards)
-
-	for t in reversed(range(n_step)):
-		if t == n_step - 1:
-			returns[t] = rewards[t] + gamma * last_values * (1.0 - last_dones)
-		else:
-			returns[t] = rewards[t] + gamma * returns[t+1] * (1.0 - dones[t+1])
-
-	return returns
-
-#-----------------------
-# Compute gae
-#-----------------------
-def compute_gae(rewards, values, dones, last_values, last_dones, gamma=0.99, lamb=0.95):
-	#rewards    : (n_step, n_env)
-	#values     : (n_step, n_env)
-	#dones      : (n_step, n_env)
-	#advs       : (n_step, n_env)
-	#last_values: (n_env)
-	#last_dones : (n_env)
-	advs         = np.zeros_like(rewards)
-	n_step       = len(rewards)
-	last_gae_lam = 0.0
-
-	for t in reversed(range(n_step)):
-		if t == n_step - 1:
-			next_nonterminal = 1.0 - last_dones
-			next_values = last_values
-		else:
-			next_nonterminal = 1.0 - dones[t+1]
-			next_values = values[t+1]
-
-		delta   = rewards[t] + gamma*next_values*next_nonterminal - values[t]
-		advs[t] = last_gae_lam = delta + gamma*lamb*next_nonterminal*last_gae_lam
-
-	return advs + values
+from rollout_buffer import RolloutBuffer
+from utils import concat_sa
+from model import RolloutModule
+from advantage import compute_gae
+from episode_stats import EpisodeStats
+import traj_store
 
 
 #Runner for multiple environment
@@ -51,7 +13,7 @@ class EnvRunner:
 	#-----------------------
 	# Constructor
 	#-----------------------
-	def __init__(self, env, sa_real, s_dim, a_dim, c_dim, traj_len=5, n_step=5, gamma=0.99, lamb=0.95, device="cuda:0", conti=False):
+	def __init__(self, env, sa_real, s_dim, a_dim, c_dim, traj_len=5, n_step=5, gamma=0.99, lamb=0.95, device="cuda:0", conti=False, double_buffer=False, sampler=None):
 		self.env      = env
 		self.sa_real  = sa_real
 		self.n_env    = env.n_env
@@ -64,6 +26,9 @@ class EnvRunner:
 		self.traj_len = traj_len
 		self.device   = device
 		self.conti    = conti
+		self.double_buffer = double_buffer
+		self.rollout_net   = RolloutModule()
+		self.sampler       = sampler if sampler is not None else traj_store.TrajectorySampler(sa_real)
 
 		#last state: (n_env, s_dim)
 		#last done : (n_env) 
@@ -71,7 +36,7 @@ class EnvRunner:
 		#sas       : (n_env, (s_dim+a_dim)*traj_len)
 		self.obs   = env.reset()
 		self.dones = np.ones((self.n_env), dtype=np.bool)
-		self.idxs  = np.array([np.random.randint(0, len(sa_real)) for _ in range(self.n_env)], dtype=np.int32)
+		self.idxs  = self.sampler.sample_traj(self.n_env).astype(np.int32)
 		self.sas   = np.zeros((self.n_env, (s_dim+a_dim)*traj_len), dtype=np.float32)
 
 		for i in range(self.n_env):
@@ -79,29 +44,35 @@ class EnvRunner:
 			idx2 = np.random.randint(traj_len, len(sa_real[idx1]))
 			self.sas[i, :] = sa_real[idx1][idx2-traj_len:idx2].flatten()
 
-		#Storages
-		self.mb_obs     = np.zeros((n_step, self.n_env, s_dim), dtype=np.float32)
-		self.mb_cs      = np.zeros((n_step, self.n_env, c_dim), dtype=np.float32)
-		self.mb_values  = np.zeros((n_step, self.n_env), dtype=np.float32)
+		#Code statistics of each env's window, cached until the window is resampled
+		#sas_cache : (n_env, (s_dim+a_dim)*traj_len) device copy of sas
+		#c_means   : (n_env, c_dim)
+		#c_logstds : (n_env, c_dim)
+		#code_stale: (n_env) windows to re-encode
+		self.sas_cache  = torch.zeros((self.n_env, (s_dim+a_dim)*traj_len), dtype=torch.float32, device=device)
+		self.c_means    = torch.zeros((self.n_env, c_dim), dtype=torch.float32, device=device)
+		self.c_logstds  = torch.zeros((self.n_env, c_dim), dtype=torch.float32, device=device)
+		self.code_stale = np.ones((self.n_env), dtype=np.bool)
+
+		#Storages (state, action, code, value, a_logp, return, expert idx/window), written in place on device
+		self.buffer = RolloutBuffer(n_step, self.n_env, {
+			"obs"    : ((s_dim,), torch.float32),
+			"actions": ((a_dim,), torch.float32) if conti else ((), torch.int64),
+			"cs"     : ((c_dim,), torch.float32),
+			"values" : ((), torch.float32),
+			"a_logps": ((), torch.float32),
+			"returns": ((), torch.float32),
+			"idxs"   : ((), torch.int64),
+			"sas"    : (((s_dim+a_dim)*traj_len,), torch.float32)
+		}, device)
+
+		#Host storages (reward, done)
 		self.mb_rewards = np.zeros((n_step, self.n_env), dtype=np.float32)
-		self.mb_a_logps = np.zeros((n_step, self.n_env), dtype=np.float32)
 		self.mb_dones   = np.zeros((n_step, self.n_env), dtype=np.bool)
-		self.mb_idxs    = np.zeros((n_step, self.n_env), dtype=np.int32)
-		self.mb_sas     = np.zeros((n_step, self.n_env, (s_dim+a_dim)*traj_len), dtype=np.float32)
 		self.mb_true_rewards = np.zeros((n_step, self.n_env), dtype=np.float32)
 
-		if conti:
-			self.mb_actions = np.zeros((n_step, self.n_env, a_dim), dtype=np.float32)
-		else:
-			self.mb_actions = np.zeros((n_step, self.n_env), dtype=np.int32)
-
 		#Reward & length recorder
-		self.total_true_rewards = np.zeros((self.n_env), dtype=np.float32)
-		self.total_rewards = np.zeros((self.n_env), dtype=np.float32)
-		self.total_len = np.zeros((self.n_env), dtype=np.int32)
-		self.true_reward_buf = deque(maxlen=100)
-		self.reward_buf = deque(maxlen=100)
-		self.len_buf = deque(maxlen=100)
+		self.stats = EpisodeStats(self.n_env, maxlen=100)
 
 	#-----------------------
 	# Get a batch for n steps
@@ -109,73 +80,30 @@ class EnvRunner:
 	def run(self, policy_net, value_net, enc_net, dis_net):
 		#1. Run n steps
 		#-------------------------------------
-		for step in range(self.n_step):
-			#obs    : (n_env, s_dim)
-			#actions: (n_env) / (n_env, a_dim)
-			#cs     : (n_env, c_dim)
-			#sas    : (n_env, (s_dim+a_dim)*3)
-			#a_logps: (n_env)
-			#values : (n_env)
-			#rewards: (n_env)
-			#dones  : (n_env)
-			obs_tensor = torch.tensor(self.obs, dtype=torch.float32, device=self.device)
-			sas_tensor = torch.tensor(self.sas, dtype=torch.float32, device=self.device)
-			cs = enc_net.get_code(sas_tensor)
-			actions, a_logps = policy_net(obs_tensor, cs)
-			values = value_net(obs_tensor, cs)
-
-			actions = actions.cpu().numpy()
-			a_logps = a_logps.cpu().numpy()
-			values  = values.cpu().numpy()
-			cs      = cs.cpu().numpy()
-
-			self.mb_obs[step, :]     = np.copy(self.obs)
-			self.mb_dones[step, :]   = np.copy(self.dones)
-			self.mb_idxs[step, :]    = np.copy(self.idxs)
-			self.mb_sas[step, :]     = np.copy(self.sas)
-			self.mb_cs[step, :]      = cs
-			self.mb_actions[step, :] = actions
-			self.mb_a_logps[step, :] = a_logps
-			self.mb_values[step, :]  = values
-
-			self.obs, rewards, self.dones, info = self.env.step(actions)
-			self.mb_true_rewards[step, :] = rewards
-
-			for i in range(self.n_env):
-				if self.dones[i]:
-					self.idxs[i] = idx1 = np.random.randint(0, len(self.sa_real))
-					idx2 = np.random.randint(self.traj_len, len(self.sa_real[idx1]))
-					self.sas[i, :] = self.sa_real[idx1][idx2-self.traj_len:idx2].flatten()
+		self.rollout_net.pack(policy_net, value_net)
+		self.code_stale[:] = True
+
+		if self.double_buffer:
+			self.run_double_buffer(policy_net, value_net, enc_net)
+		else:
+			for step in range(self.n_step):
+				actions = self.act(step, slice(None), policy_net, value_net, enc_net)
+				obs, rewards, dones, info = self.env.step(actions)
+				self.update(step, slice(None), obs, rewards, dones)
 
 		last_values = value_net(
-			torch.tensor(self.obs, dtype=torch.float32, device=self.device),
-			torch.tensor(cs, dtype=torch.float32, device=self.device)
-		).cpu().numpy()
+			torch.as_tensor(self.obs, dtype=torch.float32, device=self.device),
+			self.buffer.cs[-1]
+		)
 
 		#2. Compute reward from discriminator & encoder
 		#-------------------------------------
-		#Continuous: concat (s, a)
-		if self.conti:
-			mb_sa = torch.tensor(np.concatenate([
-				self.mb_obs.reshape(self.n_step*self.n_env, -1),
-				self.mb_actions.reshape(self.n_step*self.n_env, -1)
-			], 1), dtype=torch.float32, device=self.device)
-		
-		#Discrete: concat (s, a_onehot)
-		else:
-			mb_actions_onehot = np.zeros([self.n_step*self.n_env, self.a_dim])
-			for i in range(self.n_step):
-				for j in range(self.n_env):
-					mb_actions_onehot[i*self.n_env + j, self.mb_actions[i, j]] = 1
-
-			mb_sa = torch.tensor(np.concatenate([
-				self.mb_obs.reshape(self.n_step*self.n_env, -1),
-				mb_actions_onehot
-			], 1), dtype=torch.float32, device=self.device)
+		#(s, a) of the whole rollout, discrete actions one-hot encoded on device
+		mb_sa = concat_sa(self.buffer.flat("obs"), self.buffer.flat("actions"), self.a_dim, self.conti)
 
 		prob = dis_net.get_prob(
 			mb_sa,
-			torch.tensor(self.mb_cs.reshape(self.n_step*self.n_env, -1), dtype=torch.float32, device=self.device)
+			self.buffer.flat("cs")
 		).cpu().numpy()
 
 		self.mb_rewards = -np.log(1e-6 + 1.0 - prob).reshape(self.n_step, self.n_env)
@@ -183,7 +111,16 @@ class EnvRunner:
 
 		#3. Compute returns
 		#-------------------------------------
-		mb_returns = compute_gae(self.mb_rewards, self.mb_values, self.mb_dones, last_values, self.dones, self.gamma, self.lamb)
+		mb_returns = compute_gae(
+			torch.as_tensor(self.mb_rewards, dtype=torch.float32, device=self.device),
+			self.buffer.values,
+			torch.as_tensor(self.mb_dones, device=self.device),
+			last_values,
+			torch.as_tensor(self.dones, device=self.device),
+			self.gamma,
+			self.lamb
+		)
+		self.buffer.returns.copy_(mb_returns)
 
 		#mb_obs    : (n_step*n_env, s_dim)
 		#mb_actions: (n_step*n_env) or (n_env*n_step, a_dim)
@@ -193,61 +130,125 @@ class EnvRunner:
 		#mb_returns: (n_step*n_env)
 		#mb_idxs   : (n_step*n_env)
 		#mb_sas    : (n_step*n_env, (s_dim+a_dim)*self.traj_len)
-		if self.conti:
-			return self.mb_obs.reshape(self.n_step*self.n_env, self.s_dim), \
-					self.mb_actions.reshape(self.n_step*self.n_env, self.a_dim), \
-					self.mb_cs.reshape(self.n_step*self.n_env, self.c_dim), \
-					self.mb_a_logps.flatten(), \
-					self.mb_values.flatten(), \
-					mb_returns.flatten(), \
-					self.mb_idxs.flatten(), \
-					self.mb_sas.reshape(self.n_step*self.n_env, (self.s_dim+self.a_dim)*self.traj_len)
-
-		return self.mb_obs.reshape(self.n_step*self.n_env, self.s_dim), \
-				self.mb_actions.flatten(), \
-				self.mb_cs.reshape(self.n_step*self.n_env, self.c_dim), \
-				self.mb_a_logps.flatten(), \
-				self.mb_values.flatten(), \
-				mb_returns.flatten(), \
-				self.mb_idxs.flatten(), \
-				self.mb_sas.reshape(self.n_step*self.n_env, (self.s_dim+self.a_dim)*self.traj_len)
+		return self.buffer.flat("obs"), \
+				self.buffer.flat("actions"), \
+				self.buffer.flat("cs"), \
+				self.buffer.flat("a_logps"), \
+				self.buffer.flat("values"), \
+				self.buffer.flat("returns"), \
+				self.buffer.flat("idxs"), \
+				self.buffer.flat("sas")
+
+	#-----------------------
+	# Run n steps with two env groups (one simulates while the other is inferred)
+	#-----------------------
+	def run_double_buffer(self, policy_net, value_net, enc_net):
+		groups  = self.env.split(2)
+		pending = [None, None]
+
+		for step in range(self.n_step):
+			for i in range(2):
+				actions = self.act(step, groups[i], policy_net, value_net, enc_net)
+				self.env.step_async(actions, groups[i])
+				pending[i] = step
+
+				if pending[1-i] is not None:
+					obs, rewards, dones, info = self.env.step_wait(groups[1-i])
+					self.update(pending[1-i], groups[1-i], obs, rewards, dones)
+					pending[1-i] = None
+
+		for i in range(2):
+			if pending[i] is not None:
+				obs, rewards, dones, info = self.env.step_wait(groups[i])
+				self.update(pending[i], groups[i], obs, rewards, dones)
+
+	#-----------------------
+	# Run the networks for a group of environments
+	#-----------------------
+	def act(self, step, group, policy_net, value_net, enc_net):
+		#obs    : (n_group, s_dim)
+		#actions: (n_group) / (n_group, a_dim)
+		#cs     : (n_group, c_dim)
+		#sas    : (n_group, (s_dim+a_dim)*traj_len)
+		#a_logps: (n_group)
+		#values : (n_group)
+		obs_tensor = torch.tensor(self.obs[group], dtype=torch.float32, device=self.device)
+		self.refresh_codes(group, enc_net)
+		sas_tensor = self.sas_cache[group]
+		cs = enc_net.sample_code(self.c_means[group], self.c_logstds[group])
+		actions, a_logps, values = self.rollout_net(obs_tensor, cs)
+
+		self.buffer.obs[step, group]     = obs_tensor
+		self.buffer.idxs[step, group]    = torch.as_tensor(self.idxs[group], device=self.device)
+		self.buffer.sas[step, group]     = sas_tensor
+		self.buffer.cs[step, group]      = cs
+		self.buffer.actions[step, group] = actions
+		self.buffer.a_logps[step, group] = a_logps
+		self.buffer.values[step, group]  = values
+		self.mb_dones[step, group]       = self.dones[group]
+
+		return actions.cpu().numpy()
+
+	#-----------------------
+	# Re-encode the windows of a group that were resampled
+	#-----------------------
+	def refresh_codes(self, group, enc_net):
+		stale = np.arange(self.n_env)[group][self.code_stale[group]]
+
+		if len(stale) > 0:
+			rows = torch.as_tensor(stale, device=self.device)
+			self.sas_cache[rows] = torch.as_tensor(self.sas[stale], dtype=torch.float32, device=self.device)
+			self.c_means[rows], self.c_logstds[rows] = enc_net.get_stats(self.sas_cache[rows])
+			self.code_stale[stale] = False
+
+	#-----------------------
+	# Store the step results of a group of environments
+	#-----------------------
+	def update(self, step, group, obs, rewards, dones):
+		#rewards: (n_group)
+		#dones  : (n_group)
+		self.obs[group]   = obs
+		self.dones[group] = dones
+		self.mb_true_rewards[step, group] = rewards
+
+		resets = np.arange(self.n_env)[group][dones]
+		self.idxs[resets] = self.sampler.sample_traj(len(resets))
+
+		for i in resets:
+			idx1 = self.idxs[i]
+			idx2 = np.random.randint(self.traj_len, len(self.sa_real[idx1]))
+			self.sas[i, :] = self.sa_real[idx1][idx2-self.traj_len:idx2].flatten()
+			self.code_stale[i] = True
 
 	#-----------------------
 	# Record reward & length
 	#-----------------------
 	def record(self):
-		for i in range(self.n_step):
-			for j in range(self.n_env):
-				if self.mb_dones[i, j]:
-					self.true_reward_buf.append(self.total_true_rewards[j] + self.mb_true_rewards[i, j])
-					self.reward_buf.append(self.total_rewards[j] + self.mb_rewards[i, j])
-					self.len_buf.append(self.total_len[j] + 1)
-					self.total_true_rewards[j] = 0
-					self.total_rewards[j] = 0
-					self.total_len[j] = 0
-				else:
-					self.total_true_rewards[j] += self.mb_true_rewards[i, j]
-					self.total_rewards[j] += self.mb_rewards[i, j]
-					self.total_len[j] += 1
+		#Episodes are broken down by the mode of the expert trajectory they imitate
+		self.stats.record(
+			self.mb_rewards,
+			self.mb_true_rewards,
+			self.mb_dones,
+			self.sa_real.modes[self.buffer.idxs.cpu().numpy()]
+		)
 
 	#-----------------------
 	# Get performance
 	#-----------------------
 	def get_performance(self):
-		if len(self.reward_buf) == 0:
-			mean_true_return = 0
-			std_true_return  = 0
-			mean_return = 0
-			std_return  = 0
-		else:
-			mean_true_return = np.mean(self.true_reward_buf)
-			std_true_return  = np.std(self.true_reward_buf)
-			mean_return = np.mean(self.reward_buf)
-			std_return  = np.std(self.reward_buf)
-
-		if len(self.len_buf) == 0:
-			mean_len = 0
-		else:
-			mean_len = np.mean(self.len_buf)
+		return self.stats.get_performance()
 
-		return mean_true_return, std_true_return, mean_return, std_return, mean_len
\ No newline at end of file
+	#-----------------------
+	# State (for checkpoints)
+	#-----------------------
+	def state_dict(self):
+		#Finished episode statistics & the random stream of the expert trajectories
+		#(running episodes live in the environments, they are restarted on resume)
+		return {
+			"stats": self.stats.state_dict(),
+			"sampler": self.sampler.rng.get_state()
+		}
+
+	def load_state_dict(self, state):
+		self.stats.load_state_dict(state["stats"])
+		self.sampler.rng.set_state(state["sampler"])
\ No newline at end of file
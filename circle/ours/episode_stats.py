@@ -0,0 +1,197 @@
+import numpy as np
+
+
+COLUMNS = ("true_return", "return", "length")
+
+
+#Latest maxlen episodes + running mean/var over all episodes (fixed memory)
+class EpisodeWindow():
+	#-----------------------
+	# Constructor
+	#-----------------------
+	def __init__(self, n_col, maxlen=100):
+		self.buf    = np.zeros((maxlen, n_col), dtype=np.float64)
+		self.maxlen = maxlen
+		self.pos    = 0
+		self.size   = 0
+		self.count  = 0
+		self.mean   = np.zeros((n_col), dtype=np.float64)
+		self.m2     = np.zeros((n_col), dtype=np.float64)
+
+	#-----------------------
+	# Add a batch of episodes
+	#-----------------------
+	def push(self, x):
+		#x: (n, n_col)
+		n = len(x)
+
+		if n == 0:
+			return
+
+		#Ring buffer (only the last maxlen rows can survive)
+		tail = x[-self.maxlen:]
+		self.buf[(self.pos + np.arange(len(tail))) % self.maxlen] = tail
+		self.pos  = (self.pos + len(tail)) % self.maxlen
+		self.size = min(self.size + n, self.maxlen)
+
+		#Merge batch mean/var into the running ones
+		batch_mean = x.mean(0)
+		batch_m2   = ((x - batch_mean)**2).sum(0)
+		delta      = batch_mean - self.mean
+		total      = self.count + n
+		self.mean += delta * n / total
+		self.m2   += batch_m2 + delta**2 * self.count * n / total
+		self.count = total
+
+	#-----------------------
+	# Episodes in the window
+	#-----------------------
+	def window(self):
+		return self.buf[:self.size]
+
+	#-----------------------
+	# State (for checkpoints)
+	#-----------------------
+	def state_dict(self):
+		return {
+			"buf": self.buf.copy(),
+			"pos": self.pos,
+			"size": self.size,
+			"count": self.count,
+			"mean": self.mean.copy(),
+			"m2": self.m2.copy()
+		}
+
+	def load_state_dict(self, state):
+		self.buf[:]  = state["buf"]
+		self.pos     = state["pos"]
+		self.size    = state["size"]
+		self.count   = state["count"]
+		self.mean[:] = state["mean"]
+		self.m2[:]   = state["m2"]
+
+
+#Episode returns & lengths of n_env environments, recorded a rollout at a time
+class EpisodeStats():
+	#-----------------------
+	# Constructor
+	#-----------------------
+	def __init__(self, n_env, maxlen=100):
+		self.n_env  = n_env
+		self.maxlen = maxlen
+
+		#Sums of the unfinished episodes: (n_env, [true_return, return, length])
+		self.totals     = np.zeros((n_env, len(COLUMNS)), dtype=np.float64)
+		self.last_modes = -np.ones((n_env), dtype=np.int64)
+		self.all        = EpisodeWindow(len(COLUMNS), maxlen)
+		self.per_mode   = {}
+
+	#-----------------------
+	# Record a rollout
+	#-----------------------
+	def record(self, rewards, true_rewards, dones, modes=None):
+		#rewards     : (n_step, n_env)
+		#true_rewards: (n_step, n_env)
+		#dones       : (n_step, n_env)
+		#modes       : (n_step, n_env) mode label of each step, or None
+		#An episode is closed at a done step, including that step's rewards
+		x    = np.stack([true_rewards, rewards, np.ones_like(rewards)], 2).astype(np.float64)
+		csum = np.cumsum(x, 0) + self.totals[None]
+
+		#Finished episodes ordered by env, then step
+		env_idx, step_idx = np.nonzero(np.asarray(dones).T)
+		ends   = csum[step_idx, env_idx]
+		starts = np.zeros_like(ends)
+		same   = env_idx[1:] == env_idx[:-1]
+		starts[1:][same] = ends[:-1][same]
+		episodes = ends - starts
+
+		#Carry the sums after the last done of each env
+		last    = np.append(~same, True)[:len(env_idx)]
+		settled = np.zeros_like(self.totals)
+		settled[env_idx[last]] = ends[last]
+		self.totals = csum[-1] - settled
+
+		#Same order as stepping through time
+		order    = np.lexsort((env_idx, step_idx))
+		episodes = episodes[order]
+		self.all.push(episodes)
+
+		if modes is not None:
+			#An episode takes the mode of the step before its done step
+			modes      = np.asarray(modes, dtype=np.int64)
+			prev_modes = np.concatenate([self.last_modes[None], modes[:-1]], 0)
+			ep_modes   = prev_modes[step_idx, env_idx][order]
+			self.last_modes = modes[-1].copy()
+
+			for m in np.unique(ep_modes):
+				if m not in self.per_mode:
+					self.per_mode[m] = EpisodeWindow(len(COLUMNS), self.maxlen)
+
+				self.per_mode[m].push(episodes[ep_modes == m])
+
+	#-----------------------
+	# Modes seen so far
+	#-----------------------
+	def modes(self):
+		return sorted(self.per_mode)
+
+	#-----------------------
+	# Window & running statistics (all episodes or one mode)
+	#-----------------------
+	def summary(self, mode=None):
+		win  = self.all if mode is None else self.per_mode[mode]
+		data = win.window()
+		stats = {"n_episode": win.count}
+
+		for i, name in enumerate(COLUMNS):
+			if len(data) == 0:
+				p10, p50, p90 = 0, 0, 0
+				mean, std = 0, 0
+			else:
+				p10, p50, p90 = np.percentile(data[:, i], [10, 50, 90])
+				mean, std = data[:, i].mean(), data[:, i].std()
+
+			stats[name + "_mean"] = mean
+			stats[name + "_std"]  = std
+			stats[name + "_p10"]  = p10
+			stats[name + "_p50"]  = p50
+			stats[name + "_p90"]  = p90
+			stats[name + "_total_mean"] = win.mean[i]
+			stats[name + "_total_std"]  = np.sqrt(win.m2[i] / max(win.count, 1))
+
+		return stats
+
+	#-----------------------
+	# Get performance
+	#-----------------------
+	def get_performance(self):
+		stats = self.summary()
+
+		return stats["true_return_mean"], \
+				stats["true_return_std"], \
+				stats["return_mean"], \
+				stats["return_std"], \
+				stats["length_mean"]
+
+	#-----------------------
+	# State of the finished episodes (for checkpoints)
+	#-----------------------
+	def state_dict(self):
+		return {
+			"all": self.all.state_dict(),
+			"per_mode": {m: w.state_dict() for m, w in self.per_mode.items()}
+		}
+
+	#-----------------------
+	# Restore it (unfinished episodes are not kept: the environments restart them on resume)
+	#-----------------------
+	def load_state_dict(self, state):
+		self.totals[:]     = 0
+		self.last_modes[:] = -1
+		self.all.load_state_dict(state["all"])
+		self.per_mode = {}
+
+		for m, s in state["per_mode"].items():
+			self.per_mode[m] = EpisodeWindow(len(COLUMNS), self.maxlen)
+			self.per_mode[m].load_state_dict(s)
@@ -92,17 +92,28 @@ class RNNEncoder(nn.Module):
 		self.gru  = nn.GRU(sa_dim, h_dim, num_layers=n_layer, bidirectional=bidirectional)
 		self.fc_z = nn.Linear(h_dim*self.n_layer*self.n_dir, z_dim*2)
 
+	#-----------------------
+	# Final states of all layers & directions, per sequence
+	#-----------------------
+	def flatten_hidden(self, h):
+		#h: (n_layer*n_dir, [mb_size,] h_dim) -> (mb_size, h_dim*n_layer*n_dir)
+		if h.dim() == 3:
+			h = h.transpose(0, 1)
+
+		return h.reshape(-1, self.h_dim*self.n_layer*self.n_dir)
+
 	#-----------------------
 	# Forward
 	#-----------------------
 	def forward(self, traj, seq_lens):
-		#traj: (seq_len, mb_size, sa_dim)
-		#h   : (n_layer*n_dir, mb_size, h_dim)
-		pack   = torch.nn.utils.rnn.pack_padded_sequence(traj, seq_lens, enforce_sorted=False)
-		out, h = self.gru(traj, None)
+		#traj    : (seq_len, mb_size, sa_dim) padded
+		#seq_lens: (mb_size) true lengths
+		#h       : (n_layer*n_dir, mb_size, h_dim) states at the true sequence ends
+		pack   = torch.nn.utils.rnn.pack_padded_sequence(traj, torch.as_tensor(seq_lens).cpu(), enforce_sorted=False)
+		out, h = self.gru(pack, None)
 
 		#h: (mb_size, z_dim*2)
-		h = self.fc_z(h.view(-1, self.h_dim*self.n_layer*self.n_dir))
+		h = self.fc_z(self.flatten_hidden(h))
 		z_mean   = h[:, :self.z_dim]
 		z_logstd = h[:, self.z_dim:]
 
@@ -117,13 +128,17 @@ class RNNEncoder(nn.Module):
 	#-----------------------
 	# Get latent code
 	#-----------------------
-	def get_code(self, traj, deterministic=True):
-		#traj: (seq_len, mb_size, sa_dim)
-		#h   : (n_layer*n_dir, mb_size, h_dim)
+	def get_code(self, traj, deterministic=True, seq_lens=None):
+		#traj    : (seq_len, [mb_size,] sa_dim)
+		#seq_lens: (mb_size) true lengths of a padded batch, or None
+		#h       : (n_layer*n_dir, [mb_size,] h_dim)
+		if seq_lens is not None:
+			traj = torch.nn.utils.rnn.pack_padded_sequence(traj, torch.as_tensor(seq_lens).cpu(), enforce_sorted=False)
+
 		out, h = self.gru(traj, None)
 
 		#h: (mb_size, z_dim*2)
-		h = self.fc_z(h.view(-1, self.h_dim*self.n_layer*self.n_dir))
+		h = self.fc_z(self.flatten_hidden(h))
 		z_mean   = h[:, :self.z_dim]
 		z_logstd = h[:, self.z_dim:]
 
@@ -3,7 +3,9 @@ sys.path.append("..")
 
 import os
 import sys
+import argparse
 import motion_env
+import traj_store
 import torch
 import torch.nn as nn
 import numpy as np
@@ -12,68 +14,139 @@ from vae import model
 from tqdm import tqdm
 
 
+#-----------------------
+# Encode frames in large batches
+#-----------------------
+def encode(encoder, frames, batch_size=65536, device="cuda:0"):
+	#frames: (n_frame, x_dim) normalized to [0, 1]
+	#z     : (n_frame, z_dim)
+	z = np.zeros((len(frames), encoder.z_dim), dtype=np.float32)
+
+	for i in range(0, len(frames), batch_size):
+		x = torch.tensor(frames[i:i+batch_size], dtype=torch.float32, device=device)
+		z[i:i+batch_size] = encoder.mean(x).cpu().numpy()
+
+	return z
+
+
+#-----------------------
+# (s, a) rows of a batch of clips
+#-----------------------
+def build_sa(z, lens, n_hist=4):
+	#z   : (sum of lens, z_dim) latent frames of consecutive clips
+	#lens: (n_clip)
+	#Row j of a clip (n_hist <= j < len-1): s = z[j-n_hist:j] (flattened), a = z[j] - z[j-1]
+	offsets = np.cumsum(lens) - lens
+	n_row   = np.where(lens >= n_hist+1, lens - n_hist - 1, 0)
+
+	#frame: (n_row_total) global index of z[j] for every row
+	clip  = np.repeat(np.arange(len(lens)), n_row)
+	j     = np.arange(n_row.sum()) - np.repeat(np.cumsum(n_row) - n_row, n_row) + n_hist
+	frame = offsets[clip] + j
+
+	#s: (n_row_total, n_hist*z_dim), a: (n_row_total, z_dim)
+	s = z[frame[:, None] + np.arange(-n_hist, 0)[None, :]].reshape(len(frame), -1)
+	a = z[frame] - z[frame-1]
+
+	return np.concatenate([s, a], 1), n_row
+
+
+#-----------------------
+# Main
+#-----------------------
 def main():
+	#Parse arguments
+	parser = argparse.ArgumentParser()
+	parser.add_argument("data_path")
+	parser.add_argument("--save_dir", default="./vae/save")
+	parser.add_argument("--out", default="./sa_traj.pkl")
+	parser.add_argument("--batch_size", type=int, default=65536, help="frames encoded per forward")
+	parser.add_argument("--shard_clips", type=int, default=2048, help="clips processed & written per shard")
+	parser.add_argument("--no_pkl", action="store_true", help="only write the trajectory store")
+	args = parser.parse_args()
+
 	#Parameter
 	x_dim     = 63
 	z_dim     = 8
-	data_path = sys.argv[1]
-	save_dir  = "./vae/save"
+	n_hist    = 4
+	data_path = args.data_path
+	save_dir  = args.save_dir
+	device    = "cuda:0" if torch.cuda.is_available() else "cpu"
 
-	#Data: normalized from [-1, 1] to [1, 0]
+	#Data: normalized from [-1, 1] to [1, 0] (per shard, below)
 	motion_data = pkl.load(open(data_path, "rb"))
-
-	for i in range(len(motion_data)):
-		motion_data[i] = (motion_data[i] + 1.0) / 2.0
+	lens = np.array([len(x) for x in motion_data], dtype=np.int64)
 
 	#Model
-	encoder = model.Encoder(x_dim, z_dim).cuda()
+	encoder = model.Encoder(x_dim, z_dim).to(device)
 	print(encoder)
 
 	#Load model
 	if os.path.exists(os.path.join(save_dir, "model.pt")):
 		print("Loading the model ... ", end="")
-		checkpoint = torch.load(os.path.join(save_dir, "model.pt"))
+		checkpoint = torch.load(os.path.join(save_dir, "model.pt"), map_location=torch.device(device))
 		encoder.load_state_dict(checkpoint["Encoder"])
 		print("Done.")
 	else:
 		raise RuntimeError("No model saved")
 
-	#Generate (s, a) trajectories
+	#Generate (s, a) trajectories (clips shorter than n_hist+1 frames are dropped)
+	#Rows are streamed shard by shard into a memory-mapped trajectory store
 	a_dim  = z_dim
-	s_dim  = z_dim * 4
-	state  = np.zeros((4, z_dim), dtype=np.float32)
-	s_traj = []
-	a_traj = []
-
+	s_dim  = z_dim * n_hist
+	keep   = lens >= n_hist+1
+	n_rows = (lens[keep] - n_hist - 1)
+
+	store_dir = traj_store.store_path(args.out)
+	if not os.path.exists(store_dir):
+		os.mkdir(store_dir)
+	elif os.path.exists(os.path.join(store_dir, "dims.npy")):
+		os.remove(os.path.join(store_dir, "dims.npy"))
+
+	data = np.lib.format.open_memmap(
+		os.path.join(store_dir, "data.npy"),
+		mode="w+",
+		dtype=np.float32,
+		shape=(int(n_rows.sum()), s_dim+a_dim)
+	)
+	row = 0
+
+	encoder.eval()
 	with torch.no_grad():
-		for i in tqdm(range(len(motion_data))):
-			states  = []
-			actions = []
-			z_traj  = encoder.mean(torch.FloatTensor(motion_data[i]).cuda()).cpu().numpy()
+		for i in tqdm(range(0, len(motion_data), args.shard_clips)):
+			clips = [x for x, k in zip(motion_data[i:i+args.shard_clips], keep[i:i+args.shard_clips]) if k]
 
-			if len(z_traj) < 5:
+			if len(clips) == 0:
 				continue
 
-			for j in range(4):
-				state[j, :] = z_traj[j]
-
-			for j in range(4, len(z_traj)-1):
-				states.append(state.flatten())
-				actions.append((z_traj[j] - state[3]))
-
-				for k in range(3):
-					state[k, :] = state[k+1, :]
+			frames = (np.concatenate(clips, 0).astype(np.float32) + 1.0) / 2.0
+			z      = encode(encoder, frames, args.batch_size, device)
+			sa, _  = build_sa(z, np.array([len(x) for x in clips]), n_hist)
 
-				state[3, :] = z_traj[j]
+			data[row:row+len(sa)] = sa
+			row += len(sa)
 
-			s_traj.append(np.array(states, dtype=np.float32))
-			a_traj.append(np.array(actions, dtype=np.float32))
+	data.flush()
 
 	#Save data
 	print("Saving the data ... ", end="")
-	pkl.dump((s_traj, a_traj), open("./sa_traj.pkl", "wb"))
+	store = traj_store.TrajectoryStore(
+		data,
+		np.concatenate([[0], np.cumsum(n_rows)]).astype(np.int64),
+		-np.ones((len(n_rows)), dtype=np.int64),
+		s_dim
+	)
+	np.save(os.path.join(store_dir, "offsets.npy"), store.offsets)
+	np.save(os.path.join(store_dir, "modes.npy"), store.modes)
+
+	if not args.no_pkl:
+		pkl.dump((store.s_traj(), store.a_traj()), open(args.out, "wb"))
+
+	#dims.npy last: marks the store as complete and newer than the pickle
+	np.save(os.path.join(store_dir, "dims.npy"), np.array([s_dim, a_dim], dtype=np.int64))
 	print("Done.")
+	print("{} trajectories, {} frames".format(len(store), len(store.data)))
 
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()
@@ -0,0 +1,92 @@
+from model import PolicyNet
+import torch
+import time
+
+
+#-----------------------
+# Time a function (seconds per call)
+#-----------------------
+def timeit(fn, n_iter):
+	for _ in range(10):
+		fn()
+
+	if torch.cuda.is_available():
+		torch.cuda.synchronize()
+
+	t_start = time.time()
+	for _ in range(n_iter):
+		fn()
+
+	if torch.cuda.is_available():
+		torch.cuda.synchronize()
+
+	return (time.time() - t_start) / n_iter
+
+#-----------------------
+# Main function
+#-----------------------
+def main():
+	#Parameters
+	#----------------------------
+	s_dim       = 32
+	a_dim       = 8
+	c_dim       = 2
+	batch_sizes = [8, 1024]
+	n_iter      = 1000
+	device      = "cuda:0" if torch.cuda.is_available() else "cpu"
+
+	for conti in [True, False]:
+		for batch_size in batch_sizes:
+			#Same weights with the distribution-object heads & the closed-form heads
+			#----------------------------
+			policy_net = PolicyNet(s_dim, a_dim, c_dim, conti=conti).to(device)
+			fast_net   = PolicyNet(s_dim, a_dim, c_dim, conti=conti, fast=True).to(device)
+			fast_net.load_state_dict(policy_net.state_dict())
+
+			obs = torch.randn((batch_size, s_dim), device=device)
+			cs  = torch.randn((batch_size, c_dim), device=device)
+
+			#Outputs must match (same random stream when sampling)
+			#----------------------------
+			with torch.no_grad():
+				torch.manual_seed(0)
+				actions, a_logps = policy_net(obs, cs)
+				torch.manual_seed(0)
+				fast_actions, fast_a_logps = fast_net(obs, cs)
+
+			a_logps, ents = policy_net.evaluate(obs, actions, cs)
+			fast_a_logps, fast_ents = fast_net.evaluate(obs, actions, cs)
+
+			a_logps.sum().backward()
+			fast_a_logps.sum().backward()
+
+			print("{:s} batch {:4d} | action diff = {:.3e} | log-prob diff = {:.3e} | entropy diff = {:.3e} | grad diff = {:.3e}".format(
+				"Gaussian   " if conti else "Categorical",
+				batch_size,
+				(actions.float() - fast_actions.float()).abs().max().item(),
+				(a_logps - fast_a_logps).abs().max().item(),
+				(ents - fast_ents).abs().max().item(),
+				max((p.grad - q.grad).abs().max().item() for p, q in zip(policy_net.parameters(), fast_net.parameters()))
+			))
+
+			#Per-call time
+			#----------------------------
+			for name, fn in [
+				("forward    ", lambda net: net(obs, cs)),
+				("action_step", lambda net: net.action_step(obs, cs)),
+				("evaluate   ", lambda net: net.evaluate(obs, actions, cs))
+			]:
+				with torch.no_grad():
+					t_fixed = timeit(lambda: fn(policy_net), n_iter)
+					t_fast  = timeit(lambda: fn(fast_net), n_iter)
+
+				print("  {:s} | distributions: {:7.1f} us | closed form: {:7.1f} us | saving: {:5.1f}%".format(
+					name,
+					t_fixed*1e6,
+					t_fast*1e6,
+					100*(1 - t_fast/t_fixed)
+				))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,144 @@
+import sys
+sys.path.insert(0, "..")
+
+from model import PolicyNet, ValueNet, DiscriminatorNet, EncoderNet
+from agent import PPO
+import torch
+import time
+import traj_store
+import numpy as np
+
+
+#-----------------------
+# Time a function (seconds per call)
+#-----------------------
+def timeit(fn, n_iter):
+	for _ in range(3):
+		fn()
+
+	if torch.cuda.is_available():
+		torch.cuda.synchronize()
+
+	t_start = time.time()
+	for _ in range(n_iter):
+		fn()
+
+	if torch.cuda.is_available():
+		torch.cuda.synchronize()
+
+	return (time.time() - t_start) / n_iter
+
+#-----------------------
+# Main function
+#-----------------------
+def main():
+	#Parameters
+	#----------------------------
+	s_dim          = 32
+	a_dim          = 8
+	c_dim          = 2
+	mb_size        = 1024
+	sample_mb_size = 64
+	sample_n_epoch = 4
+	n_iter         = 20
+	device         = "cuda:0" if torch.cuda.is_available() else "cpu"
+
+	#Synthetic expert trajectories & rollout
+	#----------------------------
+	rng     = np.random.RandomState(0)
+	lens    = rng.randint(20, 100, 64)
+	sa_real = traj_store.from_lists(
+		[rng.randn(n, s_dim).astype(np.float32) for n in lens],
+		[rng.randn(n, a_dim).astype(np.float32) for n in lens]
+	)
+
+	mb_obs         = torch.randn((mb_size, s_dim), device=device)
+	mb_actions     = torch.randn((mb_size, a_dim), device=device)
+	mb_cs          = torch.randn((mb_size, c_dim), device=device)
+	mb_values      = torch.randn((mb_size), device=device)
+	mb_advs        = torch.randn((mb_size), device=device)
+	mb_returns     = mb_values + mb_advs
+	mb_old_a_logps = -torch.rand((mb_size), device=device) * 5
+
+	#Same weights with the separate & the fused update
+	#----------------------------
+	def make_agent(fused):
+		torch.manual_seed(0)
+		policy_net = PolicyNet(s_dim, a_dim, c_dim, conti=True, fast=True).to(device)
+		value_net  = ValueNet(s_dim).to(device)
+		enc_net    = EncoderNet(s_dim+a_dim, c_dim, conti=True).to(device)
+		dis_net    = DiscriminatorNet(s_dim+a_dim).to(device)
+		nets       = [policy_net, value_net, dis_net, enc_net]
+
+		agent      = PPO(
+			policy_net,
+			value_net,
+			dis_net,
+			enc_net,
+			sa_real.data,
+			a_dim,
+			beta=0.1,
+			lr=1e-4,
+			max_grad_norm=0.5,
+			ent_weight=0.01,
+			clip_val=0.2,
+			sample_n_epoch=sample_n_epoch,
+			sample_mb_size=sample_mb_size,
+			mb_size=mb_size,
+			device=device,
+			conti=True,
+			fused=fused
+		)
+
+		return agent, nets
+
+	def train(agent, nets):
+		agent.train(
+			*nets,
+			mb_obs,
+			mb_actions,
+			mb_cs,
+			mb_values,
+			mb_advs,
+			mb_returns,
+			mb_old_a_logps
+		)
+
+	#Losses & weights after one update must match (same random stream)
+	#----------------------------
+	results = []
+	for fused in [False, True]:
+		agent, nets = make_agent(fused)
+		torch.manual_seed(1)
+		np.random.seed(1)
+		train(agent, nets)
+		results.append((agent.get_eval(), [p.detach().clone() for net in nets for p in net.parameters()]))
+
+	print("fused update | loss diff = {:.3e} | weight diff = {:.3e}".format(
+		max(abs(x - y) for x, y in zip(results[0][0], results[1][0])),
+		max((p - q).abs().max().item() for p, q in zip(results[0][1], results[1][1]))
+	))
+
+	#Per-minibatch PPO time (the discriminator update, timed alone, is subtracted)
+	#----------------------------
+	n_mb = sample_n_epoch * (mb_size // sample_mb_size)
+	t    = []
+	for fused in [False, True]:
+		agent, nets = make_agent(fused)
+
+		agent.sample_n_epoch = 0
+		t_dis = timeit(lambda: train(agent, nets), n_iter)
+		agent.sample_n_epoch = sample_n_epoch
+		t_all = timeit(lambda: train(agent, nets), n_iter)
+
+		t.append((t_all - t_dis) / n_mb)
+
+	print("PPO minibatch | separate: {:7.1f} us | fused: {:7.1f} us | saving: {:5.1f}%".format(
+		t[0]*1e6,
+		t[1]*1e6,
+		100*(1 - t[1]/t[0])
+	))
+
+
+if __name__ == '__main__':
+	main()
@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import math
 from utils import init
 
 
@@ -47,13 +48,50 @@ class FixedCategorical(torch.distributions.Categorical):
 	def mode(self):
 		return self.probs.argmax(dim=-1, keepdim=True)
 
+#Categorical distribution in closed form (same results as FixedCategorical, no distribution object)
+class FastCategorical():
+	#-----------------------
+	# Constructor
+	#-----------------------
+	def __init__(self, logits):
+		self.logits = logits - logits.logsumexp(dim=-1, keepdim=True)
+		self.probs  = torch.softmax(self.logits, dim=-1)
+
+	#-----------------------
+	# Sample
+	#-----------------------
+	def sample(self):
+		return torch.multinomial(self.probs, 1, True)
+
+	#-----------------------
+	# Log-probability
+	#-----------------------
+	def log_probs(self, actions):
+		return self.logits \
+			.gather(-1, actions.long().view(-1, 1)) \
+			.view(actions.size(0), -1) \
+			.sum(-1)
+
+	#-----------------------
+	# Entropy
+	#-----------------------
+	def entropy(self):
+		return -(self.logits * self.probs).sum(-1)
+
+	#-----------------------
+	# Mode
+	#-----------------------
+	def mode(self):
+		return self.probs.argmax(dim=-1, keepdim=True)
+
 
 class Categorical(nn.Module):
 	#-----------------------
 	# Constructor
 	#-----------------------
-	def __init__(self, n_inp, n_out):
+	def __init__(self, n_inp, n_out, fast=False):
 		super(Categorical, self).__init__()
+		self.fast = fast
 
 		init_ = lambda m: init(
 			m,
@@ -70,6 +108,9 @@ class Categorical(nn.Module):
 	# Forward
 	#-----------------------
 	def forward(self, x):
+		if self.fast:
+			return FastCategorical(self.linear(x))
+
 		return FixedCategorical(logits=self.linear(x))
 
 
@@ -93,13 +134,48 @@ class FixedNormal(torch.distributions.Normal):
 	def mode(self):
 		return self.mean
 
+#Diagonal Gaussian in closed form on raw (mean, std) tensors (same results as FixedNormal, no distribution object)
+class FastNormal():
+	#-----------------------
+	# Constructor
+	#-----------------------
+	def __init__(self, mean, std):
+		self.mean = mean
+		self.std  = std
+
+	#-----------------------
+	# Sample
+	#-----------------------
+	def sample(self):
+		with torch.no_grad():
+			return torch.normal(self.mean, self.std)
+
+	#-----------------------
+	# Log-probability
+	#-----------------------
+	def log_probs(self, actions):
+		return (-(actions - self.mean)**2 / (2*self.std**2) - self.std.log() - math.log(math.sqrt(2*math.pi))).sum(-1)
+
+	#-----------------------
+	# Entropy
+	#-----------------------
+	def entropy(self):
+		return (0.5 + 0.5*math.log(2*math.pi) + self.std.log()).sum(-1)
+
+	#-----------------------
+	# Mode
+	#-----------------------
+	def mode(self):
+		return self.mean
+
 
 class DiagGaussian(nn.Module):
 	#-----------------------
 	# Constructor
 	#-----------------------
-	def __init__(self, n_inp, n_out):
+	def __init__(self, n_inp, n_out, fast=False):
 		super(DiagGaussian, self).__init__()
+		self.fast = fast
 
 		init_ = lambda m: init(
 			m,
@@ -115,6 +191,12 @@ class DiagGaussian(nn.Module):
 	def forward(self, x):
 		action_mean = self.fc_mean(x)
 
+		#Bias only, without adding it to a zero tensor
+		if self.fast:
+			action_logstd = self.logstd._bais.t().expand_as(action_mean)
+
+			return FastNormal(0.1*action_mean, 0.1*action_logstd.exp())
+
 		zeros = torch.zeros(action_mean.size())
 		if x.is_cuda:
 			zeros = zeros.cuda()
@@ -2,7 +2,10 @@ from multi_env import MultiEnv, make_env
 from env_runner import EnvRunner
 from model import PolicyNet, ValueNet, DiscriminatorNet, EncoderNet
 from agent import PPO
+from checkpoint import CheckpointManager, rng_state, set_rng_state
 import torch
+import motion_env
+import traj_store
 import os
 import sys
 import time
@@ -40,29 +43,50 @@ def main():
 	save_step      = 300
 	check_step     = 1000
 	save_dir       = "./save"
+	max_keep       = 3
 	device         = "cuda:0" if torch.cuda.is_available() else "cpu"
 	expert_path    = args.path
+	shared_memory  = False
+	double_buffer  = False
+	fast_dist      = True
+	fused_update   = True
+	n_prefetch     = 4
+	expert_seed    = 0
+	sample_by_length = True
+	mode_weights   = None
+	#Mode labels of an unlabelled expert set as contiguous blocks (needed by mode_weights & the per-mode returns)
+	expert_modes   = 0
+	envs_per_worker = 1
+	torch_env      = False
 
 	#Load expert trajectories
 	#----------------------------
-	if os.path.exists(expert_path):
-		s_real, a_real = pkl.load(open(expert_path, "rb"))
-		s_dim   = s_real[0].shape[1]
-		a_dim   = a_real[0].shape[1]
+	if traj_store.exists(expert_path):
+		store   = traj_store.load(expert_path, n_mode=expert_modes)
+		s_dim   = store.s_dim
+		a_dim   = store.a_dim
 		c_dim   = 2
-		sa_real = []
-
-		for i in range(len(s_real)):
-			sa_real.append(np.concatenate([s_real[i], a_real[i]], 1))
-
-		sa_real = np.concatenate(sa_real, 0)
+		sa_real = store.data
 	else:
 		print("ERROR: No expert trajectory file found")
 		sys.exit(1)
 
+	#Expert sampler (trajectories weighted by length / mode)
+	#----------------------------
+	sampler = traj_store.TrajectorySampler(store, by_length=sample_by_length, mode_weights=mode_weights)
+
 	#Create multiple environments
 	#----------------------------
-	env    = MultiEnv([make_env(i, expert_path, rand_seed=int(time.time())) for i in range(n_env)])
+	if torch_env:
+		env = motion_env.make_torch(expert_path, n_env, device=device)
+	else:
+		env = MultiEnv(
+			[make_env(i, expert_path, rand_seed=int(time.time())) for i in range(n_env)],
+			shared_memory=shared_memory,
+			s_dim=s_dim,
+			a_dim=a_dim,
+			envs_per_worker=envs_per_worker
+		)
 	runner = EnvRunner(
 		env, 
 		s_dim, 
@@ -72,12 +96,13 @@ def main():
 		gamma,
 		lamb,
 		device=device, 
-		conti=True
+		conti=True,
+		double_buffer=double_buffer
 	)
 
 	#Create model
 	#----------------------------
-	policy_net = PolicyNet(s_dim, a_dim, c_dim, conti=True).to(device)
+	policy_net = PolicyNet(s_dim, a_dim, c_dim, conti=True, fast=fast_dist).to(device)
 	value_net  = ValueNet(s_dim).to(device)
 	dis_net    = DiscriminatorNet(s_dim+a_dim).to(device)
 	enc_net    = EncoderNet(s_dim+a_dim, c_dim, conti=True).to(device)
@@ -98,7 +123,11 @@ def main():
 		sample_mb_size, 
 		mb_size,
 		device=device,
-		conti=True
+		conti=True,
+		fused=fused_update,
+		n_prefetch=n_prefetch,
+		seed=expert_seed,
+		sampler=sampler
 	)
 	print(policy_net)
 	print(value_net)
@@ -110,7 +139,22 @@ def main():
 	if not os.path.exists(save_dir):
 		os.mkdir(save_dir)
 
-	if os.path.exists(os.path.join(save_dir, "model.pt")):
+	checkpoints = CheckpointManager(save_dir, max_keep)
+
+	if checkpoints.latest() is not None:
+		#Full training state (optimizers, expert streams, statistics, random states): resume after its iteration
+		print("Loading the training state ... ", end="")
+		state = checkpoints.load(checkpoints.latest())
+		policy_net.load_state_dict(state["PolicyNet"])
+		value_net.load_state_dict(state["ValueNet"])
+		dis_net.load_state_dict(state["DiscriminatorNet"])
+		enc_net.load_state_dict(state["EncoderNet"])
+		agent.load_state_dict(state["agent"])
+		runner.load_state_dict(state["runner"])
+		set_rng_state(state["rng"])
+		start_it = state["it"] + 1
+		print("Done.")
+	elif os.path.exists(os.path.join(save_dir, "model.pt")):
 		print("Loading the model ... ", end="")
 		checkpoint = torch.load(os.path.join(save_dir, "model.pt"), map_location=torch.device(device))
 		policy_net.load_state_dict(checkpoint["PolicyNet"])
@@ -179,34 +223,46 @@ def main():
 			print("dis_fake         = {:.3f}".format(dis_fake))
 			print()
 
-		#Save model
+		#Save model & the full training state
 		if it % save_step == 0:
 			print("Saving the model ... ", end="")
-			torch.save({
+			checkpoints.save({
 				"it": it,
 				"beta": agent.beta,
 				"PolicyNet": policy_net.state_dict(),
 				"ValueNet": value_net.state_dict(),
 				"DiscriminatorNet": dis_net.state_dict(),
 				"EncoderNet": enc_net.state_dict()
-			}, os.path.join(save_dir, "model.pt"))
+			}, "model.pt")
+			checkpoints.save_state({
+				"it": it,
+				"beta": agent.beta,
+				"PolicyNet": policy_net.state_dict(),
+				"ValueNet": value_net.state_dict(),
+				"DiscriminatorNet": dis_net.state_dict(),
+				"EncoderNet": enc_net.state_dict(),
+				"agent": agent.state_dict(),
+				"runner": runner.state_dict(),
+				"rng": rng_state()
+			}, it)
 			print("Done.")
 			print()
 
 		#Save checkpoint
 		if it % check_step == 0:
 			print("Saving the checkpoint ... ", end="")
-			torch.save({
+			checkpoints.save({
 				"it": it,
 				"beta": agent.beta,
 				"PolicyNet": policy_net.state_dict(),
 				"ValueNet": value_net.state_dict(),
 				"DiscriminatorNet": dis_net.state_dict(),
 				"EncoderNet": enc_net.state_dict()
-			}, os.path.join(save_dir, "model{}.pt".format(it)))
+			}, "model{}.pt".format(it))
 			print("Done.")
 			print()
 
+	checkpoints.close()
 	env.close()
 
 
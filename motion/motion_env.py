@@ -1,13 +1,56 @@
+import os
+import torch
 import numpy as np
 import pickle as pkl
 
 
+#-------------------------
+# Paths of the start-state pool converted from an expert file
+#-------------------------
+def start_pool_paths(data_path):
+	root = os.path.splitext(data_path)[0]
+	return root + "_start.npy", root + "_start_offsets.npy"
+
+
+#-------------------------
+# Convert the reset pool once (skipped when up to date)
+#-------------------------
+def build_start_pool(data_path, n_start=8):
+	#starts : (n_start_total, s_dim) first n_start frames of every trajectory, flat
+	#offsets: (n_traj+1) starts[offsets[i]:offsets[i+1]] belong to trajectory i
+	start_path, offset_path = start_pool_paths(data_path)
+
+	if os.path.exists(start_path) and os.path.exists(offset_path) \
+			and os.path.getmtime(offset_path) >= os.path.getmtime(data_path):
+		return start_path, offset_path
+
+	s_traj, _ = pkl.load(open(data_path, "rb"))
+	starts    = np.concatenate([traj[:n_start] for traj in s_traj]).astype(np.float32)
+	offsets   = np.concatenate([[0], np.cumsum([len(traj[:n_start]) for traj in s_traj])]).astype(np.int64)
+
+	#Write under temporary names so that concurrent readers never see partial files
+	np.save(start_path + ".tmp.npy", starts)
+	np.save(offset_path + ".tmp.npy", offsets)
+	os.replace(start_path + ".tmp.npy", start_path)
+	os.replace(offset_path + ".tmp.npy", offset_path)
+
+	return start_path, offset_path
+
+
+#-------------------------
+# Memory-map the start-state pool (read-only, pages shared between workers)
+#-------------------------
+def load_start_pool(data_path):
+	start_path, offset_path = build_start_pool(data_path)
+	return np.load(start_path, mmap_mode="r"), np.load(offset_path)
+
+
 class MotionEnv():
 	#-------------------------
 	# Constructor
 	#-------------------------
 	def __init__(self, data_path, z_dim=8, max_step=512):
-		self.s_traj, _ = pkl.load(open(data_path, "rb"))
+		self.starts, self.offsets = load_start_pool(data_path)
 		self.s_dim     = z_dim * 4
 		self.a_dim     = z_dim
 		self.z_dim     = z_dim
@@ -46,7 +89,8 @@ class MotionEnv():
 	# Reset
 	#-------------------------
 	def reset(self):
-		self.state[:] = self.s_traj[np.random.randint(0, len(self.s_traj))][np.random.randint(0, 8)].reshape(4, self.z_dim)
+		idx = np.random.randint(0, len(self.offsets) - 1)
+		self.state[:] = self.starts[np.random.randint(self.offsets[idx], self.offsets[idx+1])].reshape(4, self.z_dim)
 		self.n_step   = 1
 
 		return np.copy(self.state.flatten())
@@ -56,11 +100,88 @@ class MotionEnv():
 	# Close
 	#-------------------------
 	def close(self):
-		del self.s_traj
+		del self.starts, self.offsets
+
+
+#Batch of motion environments kept on a torch device
+class TorchMotionEnv():
+	#-------------------------
+	# Constructor
+	#-------------------------
+	def __init__(self, data_path, n_env, z_dim=8, max_step=512, device="cpu"):
+		starts, offsets = load_start_pool(data_path)
+
+		#pool  : (n_start_total, 4, z_dim) start states
+		#counts: (n_traj) number of start states per trajectory
+		#state : (n_env, 4, z_dim)
+		#n_step: (n_env)
+		self.n_env    = n_env
+		self.s_dim    = z_dim * 4
+		self.a_dim    = z_dim
+		self.z_dim    = z_dim
+		self.max_step = max_step
+		self.device   = device
+		self.pool     = torch.tensor(np.asarray(starts), dtype=torch.float32, device=device).view(-1, 4, z_dim)
+		self.offsets  = torch.tensor(offsets[:-1], dtype=torch.int64, device=device)
+		self.counts   = torch.tensor(np.diff(offsets), dtype=torch.int64, device=device)
+		self.state    = torch.zeros((n_env, 4, z_dim), dtype=torch.float32, device=device)
+		self.n_step   = torch.ones((n_env), dtype=torch.int64, device=device)
+
+
+	#-------------------------
+	# Step (auto-resets finished environments)
+	#-------------------------
+	def step(self, actions):
+		#actions: (n_env, a_dim)
+		pos_cur = self.state[:, 3] + actions
+		self.state  = torch.cat([self.state[:, 1:], pos_cur[:, None]], 1)
+		self.n_step = self.n_step + 1
+
+		out     = pos_cur.norm(dim=1) > 6.0
+		rewards = -30.0 * out.float()
+		dones   = out | (self.n_step >= self.max_step)
+		self.reset_idx(dones)
+
+		return self.state.view(self.n_env, self.s_dim).clone(), rewards, dones, (0,)*self.n_env
+
+
+	#-------------------------
+	# Reset
+	#-------------------------
+	def reset(self):
+		self.reset_idx(torch.ones((self.n_env), dtype=torch.bool, device=self.device))
+
+		return self.state.view(self.n_env, self.s_dim).clone()
+
+
+	#-------------------------
+	# Reset selected environments (without syncing the device)
+	#-------------------------
+	def reset_idx(self, mask):
+		#mask: (n_env) bool
+		idxs        = torch.randint(0, len(self.counts), (self.n_env,), device=self.device)
+		frames      = self.offsets[idxs] + (torch.rand(self.n_env, device=self.device) * self.counts[idxs]).long()
+		starts      = self.pool[frames]
+		self.state  = torch.where(mask[:, None, None], starts, self.state)
+		self.n_step = torch.where(mask, torch.ones_like(self.n_step), self.n_step)
+
+
+	#-------------------------
+	# Close
+	#-------------------------
+	def close(self):
+		del self.pool, self.offsets, self.counts
 
 
 #-------------------------
 # Make an environment
 #-------------------------
 def make(data_path, max_step=512):
-	return MotionEnv(data_path, max_step=max_step)
\ No newline at end of file
+	return MotionEnv(data_path, max_step=max_step)
+
+
+#-------------------------
+# Make a batch of environments on a torch device
+#-------------------------
+def make_torch(data_path, n_env, max_step=512, device="cpu"):
+	return TorchMotionEnv(data_path, n_env, max_step=max_step, device=device)
\ No newline at end of file
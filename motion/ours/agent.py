@@ -1,4 +1,7 @@
-from utils import linear_lr_decay
+from utils import linear_lr_decay, concat_sa, make_adam, clip_grad_norms_
+from rollout_buffer import minibatch_indices
+from prefetch import BatchPrefetcher
+import traj_store
 import torch
 import torch.nn as nn
 import numpy as np
@@ -25,11 +28,17 @@ class PPO:
 		sample_n_epoch=4,
 		sample_mb_size=64,
 		mb_size=1024,
-		device="cuda:0"
+		device="cuda:0",
+		fused=False,
+		all_pairs=False,
+		n_pair_traj=8,
+		n_prefetch=0,
+		seed=0,
+		sampler=None
 	):
-		self.opt_actor      = torch.optim.Adam(list(enc_net.parameters()) + list(policy_net.parameters()), lr)
-		self.opt_critic     = torch.optim.Adam(value_net.parameters(), lr)
-		self.opt_dis        = torch.optim.Adam(dis_net.parameters(), lr)
+		self.opt_actor      = make_adam(list(enc_net.parameters()) + list(policy_net.parameters()), lr, device, fused)
+		self.opt_critic     = make_adam(value_net.parameters(), lr, device, fused)
+		self.opt_dis        = make_adam(dis_net.parameters(), lr, device, fused)
 		self.sa_real        = sa_real
 		self.a_dim          = a_dim
 		self.beta           = beta
@@ -39,20 +48,33 @@ class PPO:
 		self.clip_val       = clip_val
 		self.sample_n_epoch = sample_n_epoch
 		self.sample_mb_size = sample_mb_size
-		self.sample_n_mb    = mb_size // sample_mb_size
-		self.rand_idx       = np.arange(mb_size)
+		self.mb_size        = mb_size
 		self.criterion      = nn.BCELoss()
 		self.ones_label     = torch.autograd.Variable(torch.ones((sample_mb_size, 1))).to(device)
 		self.zeros_label    = torch.autograd.Variable(torch.zeros((sample_mb_size, 1))).to(device)
 		self.device         = device
+		self.fused          = fused
+		self.all_pairs      = all_pairs
+		self.n_pair_traj    = n_pair_traj
 
-		self.mb_sa_real  = np.zeros((sample_mb_size, self.sa_real[0].shape[1]), dtype=np.float32)
-		self.mb_sa_left  = np.zeros((sample_mb_size, self.sa_real[0].shape[1]), dtype=np.float32)
-		self.mb_sa_right = np.zeros((sample_mb_size, self.sa_real[0].shape[1]), dtype=np.float32)
-		self.mb_label    = np.zeros((sample_mb_size, 1), dtype=np.float32)
+		#Expert (s, a) kept flat on device so that batches are a few gathers
+		#sa_data   : (total_frames, s_dim+a_dim)
+		#sa_offsets: (n_traj)
+		#sa_lens   : (n_traj)
+		#mb_label  : (sample_mb_size, 1) 1 for pairs from the same trajectory
+		self.sa_data    = torch.tensor(np.asarray(sa_real.data), dtype=torch.float32, device=device)
+		self.sa_offsets = torch.tensor(sa_real.offsets[:-1], dtype=torch.int64, device=device)
+		self.sa_lens    = torch.tensor(sa_real.lengths, dtype=torch.int64, device=device)
+		self.mb_label   = torch.zeros((sample_mb_size, 1), dtype=torch.float32, device=device)
+		self.mb_label[:sample_mb_size//2] = 1
 
-		for i in range(sample_mb_size//2):
-			self.mb_label[i, 0] = 1
+		#Contrastive batches: trajectories from the (weighted) expert sampler, own seeded random streams,
+		#built ahead by a background thread
+		self.sampler    = sampler if sampler is not None else traj_store.TrajectorySampler(sa_real)
+		self.sa_rng     = np.random.RandomState(seed)
+		self.expert_gen = torch.Generator(device=device)
+		self.expert_gen.manual_seed(seed)
+		self.contrastive_batches = BatchPrefetcher(self.get_contrastive_batch, n_prefetch, self.get_expert_state, self.set_expert_state)
 
 	#-----------------------
 	# Train PPO
@@ -73,21 +95,21 @@ class PPO:
 		mb_idxs,
 		mb_sas
 	):
-		mb_obs         = torch.tensor(mb_obs, dtype=torch.float32, device=self.device)
-		mb_actions     = torch.tensor(mb_actions, dtype=torch.float32, device=self.device)
-		mb_cs          = torch.tensor(mb_cs, dtype=torch.float32, device=self.device)
-		mb_old_values  = torch.tensor(mb_old_values, dtype=torch.float32, device=self.device)
-		mb_advs        = torch.tensor(mb_advs, dtype=torch.float32, device=self.device)
-		mb_returns     = torch.tensor(mb_returns, dtype=torch.float32, device=self.device)
-		mb_old_a_logps = torch.tensor(mb_old_a_logps, dtype=torch.float32, device=self.device)
-		mb_sas         = torch.tensor(mb_sas, dtype=torch.float32, device=self.device)
+		mb_obs         = torch.as_tensor(mb_obs, dtype=torch.float32, device=self.device)
+		mb_actions     = torch.as_tensor(mb_actions, dtype=torch.float32, device=self.device)
+		mb_cs          = torch.as_tensor(mb_cs, dtype=torch.float32, device=self.device)
+		mb_old_values  = torch.as_tensor(mb_old_values, dtype=torch.float32, device=self.device)
+		mb_advs        = torch.as_tensor(mb_advs, dtype=torch.float32, device=self.device)
+		mb_returns     = torch.as_tensor(mb_returns, dtype=torch.float32, device=self.device)
+		mb_old_a_logps = torch.as_tensor(mb_old_a_logps, dtype=torch.float32, device=self.device)
+		mb_sas         = torch.as_tensor(mb_sas, dtype=torch.float32, device=self.device)
+
+		#(s, a) of the whole rollout, discrete actions one-hot encoded once
+		mb_sa = concat_sa(mb_obs, mb_actions, self.a_dim, mb_actions.dim() == 2)
 
 		#1. Train PPO
 		for i in range(self.sample_n_epoch):
-			np.random.shuffle(self.rand_idx)
-
-			for j in range(self.sample_n_mb):
-				sample_idx         = self.rand_idx[j*self.sample_mb_size : (j+1)*self.sample_mb_size]
+			for sample_idx in minibatch_indices(self.mb_size, self.sample_mb_size, self.device):
 				sample_obs         = mb_obs[sample_idx]
 				sample_actions     = mb_actions[sample_idx]
 				sample_cs          = mb_cs[sample_idx]
@@ -97,7 +119,10 @@ class PPO:
 				sample_old_a_logps = mb_old_a_logps[sample_idx]
 				sample_sas         = mb_sas[sample_idx]
 
-				c_mean, c_logstd, c_sample = enc_net(sample_sas)
+				if self.fused:
+					c_mean, c_logstd, c_sample, c_pairs, pair_target = self.encode_fused(enc_net, sample_sas)
+				else:
+					c_mean, c_logstd, c_sample = enc_net(sample_sas)
 				sample_a_logps, sample_ents = policy_net.evaluate(sample_obs, sample_actions, c_sample)
 				sample_values = value_net(sample_obs, sample_cs)
 				self.ent = sample_ents.mean()
@@ -116,41 +141,46 @@ class PPO:
 				#KL loss
 				self.kl_reg = (c_mean.pow(2) + c_logstd.exp().pow(2) - (c_logstd.exp().pow(2) + 1e-8).log()).sum(dim=1).mean()
 
-				#Siamese loss
-				sample_sa_left, sample_sa_right, sample_label = self.get_siamese_batch()
-				dist_square   = (enc_net.get_code(sample_sa_left) - enc_net.get_code(sample_sa_right)).pow(2).sum(dim=1, keepdim=True)
-				similarity    = sample_label * dist_square
-				dissimilarity = (1 - sample_label) * torch.clamp(0.5 - torch.sqrt(dist_square + 1e-8), min=0.0).pow(2)
-				self.siamese_loss = (similarity + dissimilarity).mean()
+				#Siamese loss (sampled pairs, or all pairs of a batch of windows)
+				if not self.fused:
+					sample_sa_pairs, pair_target = self.contrastive_batches.sample()
+					c_pairs = [enc_net.get_code(sa) for sa in sample_sa_pairs]
+
+				self.siamese_loss = self.contrastive_loss(c_pairs, pair_target)
 
 				self.pg_loss = torch.max(pg_loss1, pg_loss2).mean() \
 								- self.ent_weight*self.ent \
 								+ 0.001*self.kl_reg \
 								+ 0.5*self.siamese_loss
 
-				#Train actor
-				self.opt_actor.zero_grad()
-				self.pg_loss.backward()
-				nn.utils.clip_grad_norm_(policy_net.parameters(), self.max_grad_norm)
-				self.opt_actor.step()
+				if self.fused:
+					#Train actor & critic: the two losses touch disjoint parameters,
+					#so one backward of their sum gives the same gradients as two passes
+					self.opt_actor.zero_grad()
+					self.opt_critic.zero_grad()
+					(self.pg_loss + self.v_loss).backward()
+					clip_grad_norms_([list(policy_net.parameters()), list(value_net.parameters())], self.max_grad_norm)
+					self.opt_actor.step()
+					self.opt_critic.step()
+				else:
+					#Train actor
+					self.opt_actor.zero_grad()
+					self.pg_loss.backward()
+					nn.utils.clip_grad_norm_(policy_net.parameters(), self.max_grad_norm)
+					self.opt_actor.step()
 
-				#Train critic
-				self.opt_critic.zero_grad()
-				self.v_loss.backward()
-				nn.utils.clip_grad_norm_(value_net.parameters(), self.max_grad_norm)
-				self.opt_critic.step()
+					#Train critic
+					self.opt_critic.zero_grad()
+					self.v_loss.backward()
+					nn.utils.clip_grad_norm_(value_net.parameters(), self.max_grad_norm)
+					self.opt_critic.step()
 
 		#2. Train Discriminator
-		np.random.shuffle(self.rand_idx)
-
-		for i in range(self.sample_n_mb):
-			sample_idx     = self.rand_idx[i*self.sample_mb_size : (i+1)*self.sample_mb_size]
-			sample_obs     = mb_obs[sample_idx]
-			sample_actions = mb_actions[sample_idx]
+		for sample_idx in minibatch_indices(self.mb_size, self.sample_mb_size, self.device):
 			sample_cs      = mb_cs[sample_idx]
 			sample_idxs    = mb_idxs[sample_idx]
 
-			mb_sa_fake = torch.cat([sample_obs, sample_actions], 1)
+			mb_sa_fake = mb_sa[sample_idx]
 			mb_sa_real = self.get_sa_batch(sample_idxs)
 			mb_sa_real.requires_grad_()
 
@@ -192,6 +222,41 @@ class PPO:
 		linear_lr_decay(self.opt_actor, it, n_it, self.lr)
 		linear_lr_decay(self.opt_critic, it, n_it, self.lr)
 
+	#-----------------------
+	# Training state (for checkpoints)
+	#-----------------------
+	def state_dict(self):
+		#optimizers (moments, steps, learning rates), expert batch streams, beta
+		return {
+			"opt_actor": self.opt_actor.state_dict(),
+			"opt_critic": self.opt_critic.state_dict(),
+			"opt_dis": self.opt_dis.state_dict(),
+			"expert": self.contrastive_batches.state_dict(),
+			"beta": self.beta
+		}
+
+	#-----------------------
+	# Restore the training state
+	#-----------------------
+	def load_state_dict(self, state):
+		self.opt_actor.load_state_dict(state["opt_actor"])
+		self.opt_critic.load_state_dict(state["opt_critic"])
+		self.opt_dis.load_state_dict(state["opt_dis"])
+		self.beta = state["beta"].to(self.device) if torch.is_tensor(state["beta"]) else state["beta"]
+
+		#Expert batches restart right after the last sampled one
+		self.contrastive_batches.load_state_dict(state["expert"])
+
+	#-----------------------
+	# Random state of the expert batches
+	#-----------------------
+	def get_expert_state(self):
+		return self.sa_rng.get_state(), self.expert_gen.get_state()
+
+	def set_expert_state(self, state):
+		self.sa_rng.set_state(state[0])
+		self.expert_gen.set_state(state[1])
+
 	#-----------------------
 	# Compute KL loss
 	#-----------------------
@@ -206,31 +271,115 @@ class PPO:
 		with torch.no_grad():
 			self.beta = self.beta - beta_step * (target_kl - avg_kl)
 
+	#-----------------------
+	# Sample a frame index in [low, len) of each trajectory (flat index)
+	#-----------------------
+	def sample_frames(self, idxs, low=0, generator=None):
+		n_valid = self.sa_lens[idxs] - low
+		return self.sa_offsets[idxs] + low + (torch.rand(len(idxs), device=self.device, generator=generator) * n_valid).long()
+
 	#-----------------------
 	# Get (s, a) batch
 	#-----------------------
 	def get_sa_batch(self, mb_idxs):
-		for i in range(len(mb_idxs)):
-			idx = mb_idxs[i]
-			self.mb_sa_real[i, :] = self.sa_real[idx][np.random.randint(0, len(self.sa_real[idx]))]
+		idxs = torch.as_tensor(mb_idxs, dtype=torch.int64, device=self.device)
+		return self.sa_data[self.sample_frames(idxs)]
+
+	#-----------------------
+	# Encode the rollout windows & the contrastive batch in one forward
+	#-----------------------
+	def encode_fused(self, enc_net, sample_sas):
+		#Random draws in the same order as enc_net(sample_sas) followed by get_code on each contrastive batch
+		n   = len(sample_sas)
+		eps = torch.randn((n, enc_net.c_dim), device=self.device)
+		sample_sa_pairs, pair_target = self.contrastive_batches.sample()
+
+		sizes = [n] + [len(sa) for sa in sample_sa_pairs]
+		c_means, c_logstds = enc_net.get_stats(torch.cat([sample_sas] + sample_sa_pairs))
+		c_mean, *c_mean_pairs     = c_means.split(sizes)
+		c_logstd, *c_logstd_pairs = c_logstds.split(sizes)
 
-		return torch.tensor(self.mb_sa_real, dtype=torch.float32, device=self.device)
+		#Reparameterization
+		c_sample = eps.mul(torch.exp(c_logstd)) + c_mean
+		c_pairs  = [enc_net.sample_code(m, s) for m, s in zip(c_mean_pairs, c_logstd_pairs)]
+
+		return c_mean, c_logstd, c_sample, c_pairs, pair_target
 
 	#-----------------------
 	# Get siamese batch
 	#-----------------------
 	def get_siamese_batch(self):
-		for i in range(self.sample_mb_size//2):
-			rand_idx = np.random.randint(0, len(self.sa_real))
-			n_data = len(self.sa_real[rand_idx])
-			self.mb_sa_left[i]  = self.sa_real[rand_idx][np.random.randint(0, n_data)]
-			self.mb_sa_right[i] = self.sa_real[rand_idx][np.random.randint(0, n_data)]
-
-		for i in range(self.sample_mb_size//2, self.sample_mb_size):
-			rand_idx_l, rand_idx_r = np.random.choice(len(self.sa_real), 2, replace=False)
-			self.mb_sa_left[i]  = self.sa_real[rand_idx_l][np.random.randint(0, len(self.sa_real[rand_idx_l]))]
-			self.mb_sa_right[i] = self.sa_real[rand_idx_r][np.random.randint(0, len(self.sa_real[rand_idx_r]))]
-
-		return torch.tensor(self.mb_sa_left, dtype=torch.float32, device=self.device), \
-				torch.tensor(self.mb_sa_right, dtype=torch.float32, device=self.device), \
-				torch.tensor(self.mb_label, dtype=torch.float32, device=self.device)
\ No newline at end of file
+		#First half: both sides from the same trajectory
+		#Second half: two different trajectories
+		n_same = self.sample_mb_size // 2
+		n_diff = self.sample_mb_size - n_same
+		idx_same  = self.sampler.sample_traj(n_same, self.sa_rng)
+		idx_left  = self.sampler.sample_traj(n_diff, self.sa_rng)
+		idx_right = self.sampler.sample_traj(n_diff, self.sa_rng)
+
+		#Right sides drawn from their left trajectory are redrawn from the sampler (keeps its weights)
+		clash = idx_right == idx_left
+		for i in range(1000):
+			if not clash.any():
+				break
+
+			idx_right[clash] = self.sampler.sample_traj(clash.sum(), self.sa_rng)
+			clash = idx_right == idx_left
+		else:
+			raise RuntimeError("expert sampler weights are concentrated on a single trajectory, cannot draw different pairs")
+
+		idx_left  = torch.as_tensor(np.concatenate([idx_same, idx_left]), device=self.device)
+		idx_right = torch.as_tensor(np.concatenate([idx_same, idx_right]), device=self.device)
+
+		sa_left  = self.sa_data[self.sample_frames(idx_left, generator=self.expert_gen)]
+		sa_right = self.sa_data[self.sample_frames(idx_right, generator=self.expert_gen)]
+
+		return sa_left, sa_right, self.mb_label
+
+	#-----------------------
+	# Get a batch of windows from a few trajectories (all-pairs contrastive loss)
+	#-----------------------
+	def get_window_batch(self):
+		#sample_mb_size windows spread over n_pair_traj trajectories (a trajectory drawn twice is one label)
+		idx_traj = torch.as_tensor(self.sampler.sample_traj(self.n_pair_traj, self.sa_rng), device=self.device)
+		idxs     = idx_traj[torch.arange(self.sample_mb_size, device=self.device) % self.n_pair_traj]
+
+		sa = self.sa_data[self.sample_frames(idxs, generator=self.expert_gen)]
+
+		return sa, idxs
+
+	#-----------------------
+	# Get contrastive batch: (s, a) batches to encode & their pair target
+	#-----------------------
+	def get_contrastive_batch(self):
+		if self.all_pairs:
+			sa, idxs = self.get_window_batch()
+			return [sa], idxs
+
+		sa_left, sa_right, label = self.get_siamese_batch()
+		return [sa_left, sa_right], label
+
+	#-----------------------
+	# Contrastive (margin) loss of the encoded batches
+	#-----------------------
+	def contrastive_loss(self, c_pairs, pair_target):
+		if self.all_pairs:
+			#dist_square: (B, B) squared distances of all pairs of codes
+			#pos, neg   : (B, B) pairs from the same / different trajectories (self pairs excluded)
+			c_all       = c_pairs[0]
+			dist_square = (c_all[:, None] - c_all[None]).pow(2).sum(dim=2)
+			same        = (pair_target[:, None] == pair_target[None]).float()
+			pos         = same * (1 - torch.eye(len(c_all), device=self.device))
+			neg         = 1 - same
+
+			#Positive & negative pairs weighted equally, as in the sampled pairs
+			similarity    = (pos * dist_square).sum() / pos.sum().clamp(min=1)
+			dissimilarity = (neg * torch.clamp(0.5 - torch.sqrt(dist_square + 1e-8), min=0.0).pow(2)).sum() / neg.sum().clamp(min=1)
+
+			return 0.5*similarity + 0.5*dissimilarity
+
+		dist_square   = (c_pairs[0] - c_pairs[1]).pow(2).sum(dim=1, keepdim=True)
+		similarity    = pair_target * dist_square
+		dissimilarity = (1 - pair_target) * torch.clamp(0.5 - torch.sqrt(dist_square + 1e-8), min=0.0).pow(2)
+
+		return (similarity + dissimilarity).mean()
\ No newline at end of file
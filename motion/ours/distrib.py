@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import math
 from utils import init
 
 
@@ -47,13 +48,50 @@ class FixedCategorical(torch.distributions.Categorical):
 	def mode(self):
 		return self.probs.argmax(dim=-1, keepdim=True)
 
+#Categorical distribution in closed form (same results as FixedCategorical, no distribution object)
+class FastCategorical():
+	#-----------------------
+	# Constructor
+	#-----------------------
+	def __init__(self, logits):
+		self.logits = logits - logits.logsumexp(dim=-1, keepdim=True)
+		self.probs  = torch.softmax(self.logits, dim=-1)
+
+	#-----------------------
+	# Sample
+	#-----------------------
+	def sample(self):
+		return torch.multinomial(self.probs, 1, True)
+
+	#-----------------------
+	# Log-probability
+	#-----------------------
+	def log_probs(self, actions):
+		return self.logits \
+			.gather(-1, actions.long().view(-1, 1)) \
+			.view(actions.size(0), -1) \
+			.sum(-1)
+
+	#-----------------------
+	# Entropy
+	#-----------------------
+	def entropy(self):
+		return -(self.logits * self.probs).sum(-1)
+
+	#-----------------------
+	# Mode
+	#-----------------------
+	def mode(self):
+		return self.probs.argmax(dim=-1, keepdim=True)
+
 
 class Categorical(nn.Module):
 	#-----------------------
 	# Constructor
 	#-----------------------
-	def __init__(self, n_inp, n_out):
+	def __init__(self, n_inp, n_out, fast=False):
 		super(Categorical, self).__init__()
+		self.fast = fast
 
 		init_ = lambda m: init(
 			m,
@@ -70,6 +108,9 @@ class Categorical(nn.Module):
 	# Forward
 	#-----------------------
 	def forward(self, x):
+		if self.fast:
+			return FastCategorical(self.linear(x))
+
 		return FixedCategorical(logits=self.linear(x))
 
 
@@ -93,14 +134,49 @@ class FixedNormal(torch.distributions.Normal):
 	def mode(self):
 		return self.mean
 
+#Diagonal Gaussian in closed form on raw (mean, std) tensors (same results as FixedNormal, no distribution object)
+class FastNormal():
+	#-----------------------
+	# Constructor
+	#-----------------------
+	def __init__(self, mean, std):
+		self.mean = mean
+		self.std  = std
+
+	#-----------------------
+	# Sample
+	#-----------------------
+	def sample(self):
+		with torch.no_grad():
+			return torch.normal(self.mean, self.std)
+
+	#-----------------------
+	# Log-probability
+	#-----------------------
+	def log_probs(self, actions):
+		return (-(actions - self.mean)**2 / (2*self.std**2) - self.std.log() - math.log(math.sqrt(2*math.pi))).sum(-1)
+
+	#-----------------------
+	# Entropy
+	#-----------------------
+	def entropy(self):
+		return (0.5 + 0.5*math.log(2*math.pi) + self.std.log()).sum(-1)
+
+	#-----------------------
+	# Mode
+	#-----------------------
+	def mode(self):
+		return self.mean
+
 
 class DiagGaussian(nn.Module):
 	#-----------------------
 	# Constructor
 	#-----------------------
-	def __init__(self, n_inp, n_out, use_logstd=False):
+	def __init__(self, n_inp, n_out, use_logstd=False, fast=False):
 		super(DiagGaussian, self).__init__()
 		self.use_logstd = use_logstd
+		self.fast = fast
 		self.n_out = n_out
 
 		init_ = lambda m: init(
@@ -123,8 +199,14 @@ class DiagGaussian(nn.Module):
 			h = self.fc_main(x)
 			mean   = h[:, :self.n_out]
 			logstd = h[:, self.n_out:]
+		elif self.fast:
+			mean   = self.fc_main(x)
+			logstd = self.b_logstd._bais.t().expand_as(mean)
 		else:
 			mean   = self.fc_main(x)
 			logstd = self.b_logstd(torch.zeros_like(mean))
 
+		if self.fast:
+			return FastNormal(0.1*mean, 0.1*logstd.exp())
+
 		return FixedNormal(0.1*mean, 0.1*logstd.exp())
\ No newline at end of file
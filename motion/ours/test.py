@@ -1,9 +1,12 @@
+import sys
+sys.path.insert(0, "..")
+
 from model import PolicyNet, EncoderNet
 from matplotlib import pyplot as plt
 from tqdm import tqdm
 import torch
+import traj_store
 import os
-import sys
 import argparse
 import numpy as np
 import pickle as pkl
@@ -30,14 +33,10 @@ def main():
 	#Load expert trajectories
 	#----------------------------
 	if os.path.exists(expert_path):
-		s_real, a_real = pkl.load(open(expert_path, "rb"))
-		s_dim   = s_real[0].shape[1]
-		a_dim   = a_real[0].shape[1]
+		sa_real = traj_store.load(expert_path)
+		s_dim   = sa_real.s_dim
+		a_dim   = sa_real.a_dim
 		c_dim   = 2
-		sa_real = []
-
-		for i in range(len(s_real)):
-			sa_real.append(np.concatenate([s_real[i], a_real[i]], 1))
 	else:
 		print("ERROR: No expert trajectory file found")
 		sys.exit(1)
@@ -2,7 +2,10 @@ from multi_env import MultiEnv, make_env
 from env_runner import EnvRunner
 from model import PolicyNet, ValueNet, DiscriminatorNet, EncoderNet
 from agent import PPO
+from checkpoint import CheckpointManager, rng_state, set_rng_state
 import torch
+import motion_env
+import traj_store
 import os
 import sys
 import time
@@ -40,27 +43,51 @@ def main():
 	save_step      = 300
 	check_step     = 1000
 	save_dir       = "./save"
+	max_keep       = 3
 	device         = "cuda:0" if torch.cuda.is_available() else "cpu"
 	expert_path    = args.path
+	shared_memory  = False
+	double_buffer  = False
+	fast_dist      = True
+	fused_update   = True
+	all_pairs      = False
+	n_pair_traj    = 8
+	n_prefetch     = 4
+	expert_seed    = 0
+	sample_by_length = False
+	mode_weights   = None
+	#Mode labels of an unlabelled expert set as contiguous blocks (needed by mode_weights & the per-mode returns)
+	expert_modes   = 0
+	envs_per_worker = 1
+	torch_env      = False
 
 	#Load expert trajectories
 	#----------------------------
-	if os.path.exists(expert_path):
-		s_real, a_real = pkl.load(open(expert_path, "rb"))
-		s_dim   = s_real[0].shape[1]
-		a_dim   = a_real[0].shape[1]
+	if traj_store.exists(expert_path):
+		sa_real = traj_store.load(expert_path, n_mode=expert_modes)
+		s_dim   = sa_real.s_dim
+		a_dim   = sa_real.a_dim
 		c_dim   = 2
-		sa_real = []
-
-		for i in range(len(s_real)):
-			sa_real.append(np.concatenate([s_real[i], a_real[i]], 1))
 	else:
 		print("ERROR: No expert trajectory file found")
 		sys.exit(1)
 
+	#Expert sampler (trajectories weighted by length / mode)
+	#----------------------------
+	sampler = traj_store.TrajectorySampler(sa_real, by_length=sample_by_length, mode_weights=mode_weights)
+
 	#Create multiple environments
 	#----------------------------
-	env    = MultiEnv([make_env(i, expert_path, rand_seed=int(time.time())) for i in range(n_env)])
+	if torch_env:
+		env = motion_env.make_torch(expert_path, n_env, device=device)
+	else:
+		env = MultiEnv(
+			[make_env(i, expert_path, rand_seed=int(time.time())) for i in range(n_env)],
+			shared_memory=shared_memory,
+			s_dim=s_dim,
+			a_dim=a_dim,
+			envs_per_worker=envs_per_worker
+		)
 	runner = EnvRunner(
 		env, 
 		sa_real,
@@ -70,12 +97,14 @@ def main():
 		n_step, 
 		gamma,
 		lamb,
-		device=device
+		device=device,
+		double_buffer=double_buffer,
+		sampler=sampler
 	)
 
 	#Create model
 	#----------------------------
-	policy_net = PolicyNet(s_dim, a_dim, c_dim, conti=True).to(device)
+	policy_net = PolicyNet(s_dim, a_dim, c_dim, conti=True, fast=fast_dist).to(device)
 	value_net  = ValueNet(s_dim, c_dim).to(device)
 	dis_net    = DiscriminatorNet(s_dim+a_dim, c_dim).to(device)
 	enc_net    = EncoderNet(s_dim+a_dim, c_dim).to(device)
@@ -94,7 +123,13 @@ def main():
 		sample_n_epoch, 
 		sample_mb_size, 
 		mb_size,
-		device=device
+		device=device,
+		fused=fused_update,
+		all_pairs=all_pairs,
+		n_pair_traj=n_pair_traj,
+		n_prefetch=n_prefetch,
+		seed=expert_seed,
+		sampler=sampler
 	)
 	print(policy_net)
 	print(value_net)
@@ -106,7 +141,22 @@ def main():
 	if not os.path.exists(save_dir):
 		os.mkdir(save_dir)
 
-	if os.path.exists(os.path.join(save_dir, "model.pt")):
+	checkpoints = CheckpointManager(save_dir, max_keep)
+
+	if checkpoints.latest() is not None:
+		#Full training state (optimizers, expert streams, statistics, random states): resume after its iteration
+		print("Loading the training state ... ", end="")
+		state = checkpoints.load(checkpoints.latest())
+		policy_net.load_state_dict(state["PolicyNet"])
+		value_net.load_state_dict(state["ValueNet"])
+		dis_net.load_state_dict(state["DiscriminatorNet"])
+		enc_net.load_state_dict(state["EncoderNet"])
+		agent.load_state_dict(state["agent"])
+		runner.load_state_dict(state["runner"])
+		set_rng_state(state["rng"])
+		start_it = state["it"] + 1
+		print("Done.")
+	elif os.path.exists(os.path.join(save_dir, "model.pt")):
 		print("Loading the model ... ", end="")
 		checkpoint = torch.load(os.path.join(save_dir, "model.pt"), map_location=torch.device(device))
 		policy_net.load_state_dict(checkpoint["PolicyNet"])
@@ -176,38 +226,53 @@ def main():
 			print("mean true return = {:.6f}".format(mean_true_return))
 			print("mean return      = {:.6f}".format(mean_return))
 			print("mean length      = {:.2f}".format(mean_len))
+			for m in runner.stats.modes():
+				if m >= 0:
+					print("mode {:d} return    = {:.6f}".format(m, runner.stats.summary(m)["true_return_mean"]))
 			print("dis_real         = {:.3f}".format(dis_real))
 			print("dis_fake         = {:.3f}".format(dis_fake))
 			print()
 
-		#Save model
+		#Save model & the full training state
 		if it % save_step == 0:
 			print("Saving the model ... ", end="")
-			torch.save({
+			checkpoints.save({
 				"it": it,
 				"beta": agent.beta,
 				"PolicyNet": policy_net.state_dict(),
 				"ValueNet": value_net.state_dict(),
 				"DiscriminatorNet": dis_net.state_dict(),
 				"EncoderNet": enc_net.state_dict()
-			}, os.path.join(save_dir, "model.pt"))
+			}, "model.pt")
+			checkpoints.save_state({
+				"it": it,
+				"beta": agent.beta,
+				"PolicyNet": policy_net.state_dict(),
+				"ValueNet": value_net.state_dict(),
+				"DiscriminatorNet": dis_net.state_dict(),
+				"EncoderNet": enc_net.state_dict(),
+				"agent": agent.state_dict(),
+				"runner": runner.state_dict(),
+				"rng": rng_state()
+			}, it)
 			print("Done.")
 			print()
 
 		#Save checkpoint
 		if it % check_step == 0:
 			print("Saving the checkpoint ... ", end="")
-			torch.save({
+			checkpoints.save({
 				"it": it,
 				"beta": agent.beta,
 				"PolicyNet": policy_net.state_dict(),
 				"ValueNet": value_net.state_dict(),
 				"DiscriminatorNet": dis_net.state_dict(),
 				"EncoderNet": enc_net.state_dict()
-			}, os.path.join(save_dir, "model{}.pt".format(it)))
+			}, "model{}.pt".format(it))
 			print("Done.")
 			print()
 
+	checkpoints.close()
 	env.close()
 
 
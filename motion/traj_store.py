@@ -0,0 +1,333 @@
+import os
+import argparse
+import numpy as np
+import pickle as pkl
+
+
+#Ragged trajectories stored as one flat array + offsets
+class TrajectoryStore():
+	#-------------------------
+	# Constructor
+	#-------------------------
+	def __init__(self, data, offsets, modes, s_dim):
+		#data   : (total_frames, s_dim+a_dim)
+		#offsets: (n_traj+1) data[offsets[i]:offsets[i+1]] is trajectory i
+		#lengths: (n_traj)
+		#modes  : (n_traj) mode label, -1 if unknown
+		self.data    = data
+		self.offsets = offsets
+		self.lengths = np.diff(offsets)
+		self.modes   = modes
+		self.s_dim   = s_dim
+		self.a_dim   = data.shape[1] - s_dim
+
+
+	#-------------------------
+	# Number of trajectories
+	#-------------------------
+	def __len__(self):
+		return len(self.lengths)
+
+
+	#-------------------------
+	# (s, a) of one trajectory (a view, no copy)
+	#-------------------------
+	def __getitem__(self, idx):
+		if idx < 0:
+			idx += len(self)
+
+		return self.data[self.offsets[idx]:self.offsets[idx+1]]
+
+
+	#-------------------------
+	# States / actions of every trajectory
+	#-------------------------
+	def s_traj(self):
+		return [self[i][:, :self.s_dim] for i in range(len(self))]
+
+	def a_traj(self):
+		return [self[i][:, self.s_dim:] for i in range(len(self))]
+
+
+#-------------------------
+# Build a store from per-trajectory lists
+#-------------------------
+def from_lists(s_traj, a_traj, modes=None):
+	data    = np.concatenate([np.concatenate([s, a], 1) for s, a in zip(s_traj, a_traj)], 0).astype(np.float32)
+	offsets = np.concatenate([[0], np.cumsum([len(s) for s in s_traj])]).astype(np.int64)
+
+	if modes is None:
+		modes = -np.ones((len(s_traj)), dtype=np.int64)
+
+	return TrajectoryStore(data, offsets, np.asarray(modes, dtype=np.int64), s_traj[0].shape[1])
+
+
+#-------------------------
+# Convert an (s_traj, a_traj) pickle
+#-------------------------
+def from_pickle(pkl_path, modes=None):
+	s_traj, a_traj = pkl.load(open(pkl_path, "rb"))
+	return from_lists(s_traj, a_traj, modes)
+
+
+#-------------------------
+# Save (one directory of .npy files)
+#-------------------------
+def save(store, store_dir):
+	if not os.path.exists(store_dir):
+		os.mkdir(store_dir)
+
+	np.save(os.path.join(store_dir, "data.npy"), store.data)
+	np.save(os.path.join(store_dir, "offsets.npy"), store.offsets)
+	np.save(os.path.join(store_dir, "modes.npy"), store.modes)
+	np.save(os.path.join(store_dir, "dims.npy"), np.array([store.s_dim, store.a_dim], dtype=np.int64))
+
+
+#-------------------------
+# Store directory next to a pickle
+#-------------------------
+def store_path(pkl_path):
+	return os.path.splitext(pkl_path)[0] + "_store"
+
+
+#-------------------------
+# Whether a store (or a pickle, or the store written next to it) exists
+#-------------------------
+def exists(path):
+	return os.path.exists(path) or os.path.exists(os.path.join(store_path(path), "dims.npy"))
+
+
+#-------------------------
+# Mode labels of n_traj trajectories stored as n_mode equal contiguous blocks
+#-------------------------
+def block_modes(n_traj, n_mode):
+	return (np.arange(n_traj) * n_mode // n_traj).astype(np.int64)
+
+
+#-------------------------
+# Load a store (or a pickle, converted once and cached next to it)
+#-------------------------
+def load(path, mmap=True, n_mode=0):
+	#n_mode: if the store has no mode labels (e.g. converted from a pickle), label it as n_mode contiguous blocks
+	#A missing pickle falls back to its store (e.g. written by gen_expert_traj.py --no_pkl)
+	if not os.path.isdir(path):
+		store_dir = store_path(path)
+		dims_path = os.path.join(store_dir, "dims.npy")
+
+		if os.path.exists(path) and (not os.path.exists(dims_path) or os.path.getmtime(dims_path) < os.path.getmtime(path)):
+			save(from_pickle(path), store_dir)
+
+		path = store_dir
+
+	data  = np.load(os.path.join(path, "data.npy"), mmap_mode="r" if mmap else None)
+	dims  = np.load(os.path.join(path, "dims.npy"))
+
+	store = TrajectoryStore(
+		data,
+		np.load(os.path.join(path, "offsets.npy")),
+		np.load(os.path.join(path, "modes.npy")),
+		int(dims[0])
+	)
+
+	if n_mode > 0 and (store.modes < 0).all():
+		store.modes = block_modes(len(store), n_mode)
+
+	return store
+
+
+#-------------------------
+# Alias table (Vose): O(n) build, O(1) per draw
+#-------------------------
+def alias_table(weights):
+	#prob : (n) probability of keeping the drawn column
+	#alias: (n) column taken otherwise
+	p = np.asarray(weights, dtype=np.float64)
+
+	if len(p) == 0 or not np.isfinite(p).all() or (p < 0).any():
+		raise ValueError("alias table weights must be finite and non-negative")
+
+	if p.sum() == 0:
+		raise ValueError("alias table weights sum to zero")
+
+	p     = p * len(p) / p.sum()
+	prob  = np.ones((len(p)), dtype=np.float64)
+	alias = np.arange(len(p), dtype=np.int64)
+	small = list(np.nonzero(p < 1.0)[0])
+	large = list(np.nonzero(p >= 1.0)[0])
+
+	while len(small) > 0 and len(large) > 0:
+		s = small.pop()
+		l = large.pop()
+		prob[s]  = p[s]
+		alias[s] = l
+		p[l]     = p[l] - (1.0 - p[s])
+
+		if p[l] < 1.0:
+			small.append(l)
+		else:
+			large.append(l)
+
+	return prob, alias
+
+
+#Weighted trajectory & frame sampler: an alias table over modes, then one over the trajectories of the drawn mode
+class TrajectorySampler():
+	#-------------------------
+	# Constructor
+	#-------------------------
+	def __init__(self, store, by_length=False, priority=None, mode_weights=None, seed=None):
+		#by_length   : trajectories weighted by their length (frame-uniform over the corpus), else uniform
+		#priority    : (n_traj) extra weight of each trajectory
+		#mode_weights: {mode: weight} share of each mode (default: its share of the trajectory weights),
+		#              changed by set_mode_weights without rebuilding the trajectory tables
+		self.store  = store
+		self.rng    = np.random.RandomState(seed)
+		self.tables = {}
+
+		weights = store.lengths.astype(np.float64) if by_length else np.ones((len(store)), dtype=np.float64)
+		if priority is not None:
+			priority = np.asarray(priority, dtype=np.float64)
+
+			if priority.shape != (len(store),):
+				raise ValueError("priority must have one weight per trajectory ({}), got shape {}".format(len(store), priority.shape))
+
+			if not np.isfinite(priority).all() or (priority < 0).any():
+				raise ValueError("priority must be finite and non-negative")
+
+			weights = weights * priority
+
+		if weights.sum() == 0:
+			raise ValueError("all trajectory weights are zero")
+
+		#Trajectories grouped by mode, the alias tables of all modes stored back to back
+		#order     : (n_traj) trajectory indices sorted by mode
+		#mode_start: (n_mode) start of each mode in order
+		#mode_len  : (n_mode)
+		#mode_mass : (n_mode) total trajectory weight of each mode
+		self.modes, mode_idx = np.unique(store.modes, return_inverse=True)
+		self.order      = np.argsort(mode_idx, kind="stable")
+		self.mode_len   = np.bincount(mode_idx, minlength=len(self.modes))
+		self.mode_start = np.cumsum(self.mode_len) - self.mode_len
+		self.mode_mass  = np.bincount(mode_idx, weights=weights, minlength=len(self.modes))
+		self.prob       = np.ones((len(store)), dtype=np.float64)
+		self.alias      = np.zeros((len(store)), dtype=np.int64)
+
+		#A mode without weight keeps a placeholder table (set_mode_weights never gives it mass)
+		for k in range(len(self.modes)):
+			seg = slice(self.mode_start[k], self.mode_start[k] + self.mode_len[k])
+
+			if self.mode_mass[k] > 0:
+				self.prob[seg], self.alias[seg] = alias_table(weights[self.order[seg]])
+			else:
+				self.alias[seg] = np.arange(self.mode_len[k])
+
+			self.alias[seg] += self.mode_start[k]
+
+		self.set_mode_weights(mode_weights)
+
+
+	#-------------------------
+	# Share of each mode (rebuilds only the small table over modes)
+	#-------------------------
+	def set_mode_weights(self, mode_weights=None):
+		if mode_weights is None:
+			weights = self.mode_mass
+		else:
+			weights = np.array([mode_weights.get(int(m), 0.0) for m in self.modes], dtype=np.float64)
+
+			if not np.isfinite(weights).all() or (weights < 0).any():
+				raise ValueError("mode weights must be finite and non-negative")
+
+			if weights.sum() == 0:
+				raise ValueError("mode weights give no mass to any mode of the store {}".format([int(m) for m in self.modes]))
+
+			if ((weights > 0) & (self.mode_mass == 0)).any():
+				raise ValueError("mode weights give mass to modes whose trajectories all have zero weight")
+
+		self.mode_prob, self.mode_alias = alias_table(weights)
+
+		for tables in self.tables.values():
+			tables["mode_prob"]  = tables["mode_prob"].new_tensor(self.mode_prob)
+			tables["mode_alias"] = tables["mode_alias"].new_tensor(self.mode_alias)
+
+
+	#-------------------------
+	# Draw n trajectory indices (rng: random stream of the caller, default the sampler's own)
+	#-------------------------
+	def sample_traj(self, n, rng=None):
+		rng = self.rng if rng is None else rng
+
+		#Mode, then a column of the mode's table, each kept or replaced by its alias
+		k = rng.randint(0, len(self.modes), n)
+		k = np.where(rng.rand(n) < self.mode_prob[k], k, self.mode_alias[k])
+		i = self.mode_start[k] + (rng.rand(n) * self.mode_len[k]).astype(np.int64)
+		i = np.where(rng.rand(n) < self.prob[i], i, self.alias[i])
+
+		return self.order[i]
+
+
+	#-------------------------
+	# Alias tables as tensors on a device (built on first use)
+	#-------------------------
+	def device_tables(self, device):
+		import torch
+
+		key = str(device)
+		if key not in self.tables:
+			self.tables[key] = {
+				name: torch.as_tensor(getattr(self, name), dtype=torch.float32 if name.endswith("prob") else torch.int64, device=device)
+				for name in ("order", "mode_start", "mode_len", "prob", "alias", "mode_prob", "mode_alias")
+			}
+
+		return self.tables[key]
+
+
+	#-------------------------
+	# Draw n trajectory indices on a device (generator: torch random stream of the caller)
+	#-------------------------
+	def sample_traj_torch(self, n, device, generator=None):
+		import torch
+
+		#Same two-level draw as sample_traj, without leaving the device
+		t = self.device_tables(device)
+		u = torch.rand((4, n), device=device, generator=generator)
+		k = (u[0] * len(self.modes)).long().clamp(max=len(self.modes)-1)
+		k = torch.where(u[1] < t["mode_prob"][k], k, t["mode_alias"][k])
+		i = t["mode_start"][k] + torch.minimum((u[2] * t["mode_len"][k]).long(), t["mode_len"][k]-1)
+		i = torch.where(u[3] < t["prob"][i], i, t["alias"][i])
+
+		return t["order"][i]
+
+
+	#-------------------------
+	# Draw n (trajectory, flat frame index) with the frame uniform in [low, len)
+	#-------------------------
+	def sample_frames(self, n, low=0, rng=None):
+		rng  = self.rng if rng is None else rng
+		idxs = self.sample_traj(n, rng)
+		n_valid = self.store.lengths[idxs] - low
+
+		return idxs, self.store.offsets[idxs] + low + (rng.rand(n) * n_valid).astype(np.int64)
+
+
+#-----------------------
+# Main (convert a pickle)
+#-----------------------
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("pkl_path")
+	parser.add_argument("--out", default=None)
+	parser.add_argument("--n_mode", type=int, default=0, help="label trajectories as n_mode equal contiguous blocks")
+	args = parser.parse_args()
+
+	store = from_pickle(args.pkl_path)
+
+	if args.n_mode > 0:
+		store.modes = block_modes(len(store), args.n_mode)
+
+	save(store, args.out or store_path(args.pkl_path))
+	print("{} trajectories, {} frames".format(len(store), len(store.data)))
+
+
+if __name__ == '__main__':
+	main()
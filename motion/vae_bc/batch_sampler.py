@@ -0,0 +1,79 @@
+import torch
+import numpy as np
+
+
+#Length-bucketed trajectory sampler: minibatches of trajectories with similar lengths, padded on device
+class BucketSampler():
+	#-----------------------
+	# Constructor
+	#-----------------------
+	def __init__(self, s_traj, a_traj, mb_size=256, n_pool=16, device="cuda:0"):
+		#s_traj: list of (seq_len, s_dim) arrays
+		#a_traj: list of (seq_len, a_dim) arrays
+		#n_pool: each epoch, trajectories are shuffled, cut into pools of n_pool minibatches
+		#        and sorted by length inside each pool (larger pools = less padding, less randomness)
+		#(mb_size is clamped to the number of trajectories)
+		self.mb_size = min(mb_size, len(s_traj))
+		self.n_pool  = n_pool
+		self.device  = device
+		self.s_dim   = s_traj[0].shape[1]
+		self.a_dim   = a_traj[0].shape[1]
+
+		#All frames kept flat on device
+		#data   : (total_frames, s_dim+a_dim)
+		#offsets: (n_traj)
+		#lens   : (n_traj)
+		lens = np.array([len(s) for s in s_traj], dtype=np.int64)
+		self.data = torch.tensor(
+			np.concatenate([np.concatenate([s, a], 1) for s, a in zip(s_traj, a_traj)], 0),
+			dtype=torch.float32,
+			device=device
+		)
+		self.lens_cpu = torch.tensor(lens)
+		self.lens     = self.lens_cpu.to(device)
+		self.offsets  = torch.tensor(np.cumsum(lens) - lens, device=device)
+		self.n_traj   = len(lens)
+		self.n_batch  = self.n_traj // self.mb_size
+		self.epoch    = 0
+		self.batches  = []
+
+	#-----------------------
+	# Minibatches of one epoch
+	#-----------------------
+	def new_epoch(self):
+		#Sort by (pool, length), cut into minibatches, then shuffle the minibatch order
+		perm  = torch.randperm(self.n_traj)
+		pools = torch.arange(self.n_traj) // (self.mb_size*self.n_pool)
+		key   = pools * (int(self.lens_cpu.max()) + 1) + self.lens_cpu[perm]
+		order = perm[torch.argsort(key)][:self.n_batch*self.mb_size]
+
+		self.batches = list(order.view(self.n_batch, self.mb_size)[torch.randperm(self.n_batch)])
+		self.epoch  += 1
+
+	#-----------------------
+	# Sample a batch
+	#-----------------------
+	def sample(self):
+		if len(self.batches) == 0:
+			self.new_epoch()
+
+		idx      = self.batches.pop()
+		seq_lens = self.lens_cpu[idx]
+		idx      = idx.to(self.device)
+		max_len  = int(seq_lens.max())
+
+		#Padded (time-major) batch gathered in one indexing op
+		#frames : (max_len, mb_size)
+		#mb_mask: (max_len, mb_size)
+		t       = torch.arange(max_len, device=self.device)[:, None]
+		mb_mask = t < self.lens[idx][None]
+		frames  = torch.where(mb_mask, self.offsets[idx][None] + t, torch.zeros_like(t))
+
+		#mb_sa_traj: (max_len, mb_size, s_dim+a_dim)
+		mb_sa_traj = self.data[frames] * mb_mask[:, :, None]
+
+		return mb_sa_traj[:, :, :self.s_dim], \
+				mb_sa_traj[:, :, self.s_dim:], \
+				mb_sa_traj, \
+				mb_mask.float(), \
+				seq_lens
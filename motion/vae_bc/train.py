@@ -6,46 +6,7 @@ import argparse
 import numpy as np
 import pickle as pkl
 from model import PolicyNet, RNNEncoder
-
-
-#-----------------------
-# Sample a batch
-#-----------------------
-def sample_batch(s_traj, a_traj, mb_size=256):
-	s_trajs  = []
-	a_trajs  = []
-	seq_lens = []
-	max_len  = 0
-
-	for i in range(mb_size):
-		rand_idx = np.random.randint(0, len(s_traj))
-		s_trajs.append(s_traj[rand_idx])
-		a_trajs.append(a_traj[rand_idx])
-		seq_lens.append(len(s_traj[rand_idx]))
-
-		if max_len < len(s_traj[rand_idx]):
-			max_len = len(s_traj[rand_idx])
-
-	#mb_s_traj: (mb_size, max_len, s_dim)
-	#mb_a_traj: (mb_size, max_len, a_dim)
-	#mb_mask  : (mb_size, max_len)
-	mb_s_traj = np.zeros((mb_size, max_len, len(s_traj[0][0])), dtype=np.float32) 
-	mb_a_traj = np.zeros((mb_size, max_len, len(a_traj[0][0])), dtype=np.float32)
-	mb_mask   = np.ones((mb_size, max_len), dtype=np.float32)
-
-	for i in range(mb_size):
-		mb_s_traj[i, :len(s_trajs[i]), :] = s_trajs[i]
-		mb_a_traj[i, :len(a_trajs[i]), :] = a_trajs[i]
-		mb_mask[i, seq_lens[i]:] = np.zeros((max_len - seq_lens[i]), dtype=np.float32)
-
-	#mb_s_traj: (max_len, mb_size, s_dim)
-	#mb_a_traj: (max_len, mb_size, a_dim)
-	#mb_mask  : (max_len, mb_size)
-	mb_s_traj = mb_s_traj.transpose((1, 0, 2))
-	mb_a_traj = mb_a_traj.transpose((1, 0, 2))
-	mb_mask   = mb_mask.transpose((1, 0))
-		
-	return mb_s_traj, mb_a_traj, np.concatenate([mb_s_traj, mb_a_traj], axis=2), mb_mask, seq_lens
+from batch_sampler import BucketSampler
 
 
 #-----------------------
@@ -69,11 +30,13 @@ def main():
 	save_dir    = "./save"
 	device      = "cuda:0" if torch.cuda.is_available() else "cpu"
 	expert_path = args.path
+	n_pool      = 16
 
 	#Load expert trajectories
 	#----------------------------
 	if os.path.exists(expert_path):
 		s_traj, a_traj = pkl.load(open(expert_path, "rb"))
+		sampler = BucketSampler(s_traj, a_traj, mb_size, n_pool, device=device)
 	else:
 		print("ERROR: No expert trajectory file found")
 		sys.exit(1)
@@ -113,19 +76,19 @@ def main():
 
 	for it in range(start_it, start_it+n_iter):
 		#Train
-		mb_s_trajs, mb_a_trajs, mb_sa_trajs, mb_mask, seq_lens = sample_batch(s_traj, a_traj, mb_size)
-		mb_s_trajs = torch.tensor(mb_s_trajs, dtype=torch.float32, device=device).contiguous()
-		mb_a_trajs = torch.tensor(mb_a_trajs, dtype=torch.float32, device=device).contiguous()
-		mb_sa_trajs = torch.tensor(mb_sa_trajs, dtype=torch.float32, device=device).contiguous()
-		mb_mask = torch.tensor(mb_mask, dtype=torch.float32, device=device)
+		mb_s_trajs, mb_a_trajs, mb_sa_trajs, mb_mask, seq_lens = sampler.sample()
+
+		#Reconstruct the valid frames only (padding contributes nothing to the loss)
+		valid = mb_mask.bool()
+		_, valid_idx = valid.nonzero(as_tuple=True)
 
 		c_mean, c_logstd, c_sample = enc_net(mb_sa_trajs, seq_lens)
 		mb_a_logps, mb_ents = policy_net.evaluate(
-			mb_s_trajs.view(-1, s_dim),
-			mb_a_trajs.view(-1, a_dim),
-			c_sample.unsqueeze(0).repeat(mb_s_trajs.size(0), 1, 1).view(-1, c_dim)
+			mb_s_trajs[valid],
+			mb_a_trajs[valid],
+			c_sample[valid_idx]
 		)
-		recon_loss = -(mb_a_logps.view(-1, mb_size) * mb_mask).sum(0).mean()
+		recon_loss = -mb_a_logps.sum() / sampler.mb_size
 		kl_reg = (c_mean.pow(2) + c_logstd.exp().pow(2) - (c_logstd.exp().pow(2) + 1e-8).log()).sum(dim=1).mean()
 		loss = recon_loss + 0.001*kl_reg
 
@@ -1,4 +1,6 @@
-from utils import linear_lr_decay
+from utils import linear_lr_decay, concat_sa, make_adam, clip_grad_norms_
+from rollout_buffer import minibatch_indices
+from prefetch import BatchPrefetcher
 import torch
 import torch.nn as nn
 import numpy as np
@@ -23,11 +25,15 @@ class PPO:
 		sample_mb_size=64,
 		mb_size=1024,
 		device="cuda:0", 
-		conti=False
+		conti=False,
+		fused=False,
+		n_prefetch=0,
+		seed=0,
+		sampler=None
 	):
-		self.opt_actor      = torch.optim.Adam(policy_net.parameters(), lr)
-		self.opt_critic     = torch.optim.Adam(value_net.parameters(), lr)
-		self.opt_dis        = torch.optim.Adam(dis_net.parameters(), lr)
+		self.opt_actor      = make_adam(policy_net.parameters(), lr, device, fused)
+		self.opt_critic     = make_adam(value_net.parameters(), lr, device, fused)
+		self.opt_dis        = make_adam(dis_net.parameters(), lr, device, fused)
 		self.a_dim          = a_dim
 		self.lr             = lr
 		self.max_grad_norm  = max_grad_norm
@@ -35,14 +41,23 @@ class PPO:
 		self.clip_val       = clip_val
 		self.sample_n_epoch = sample_n_epoch
 		self.sample_mb_size = sample_mb_size
-		self.sample_n_mb    = mb_size // sample_mb_size
-		self.rand_idx       = np.arange(mb_size)
+		self.mb_size        = mb_size
 		self.criterion      = nn.BCELoss()
 		self.ones_label     = torch.autograd.Variable(torch.ones((sample_mb_size, 1))).to(device)
 		self.zeros_label    = torch.autograd.Variable(torch.zeros((sample_mb_size, 1))).to(device)
 		self.device         = device
+		self.fused          = fused
 		self.conti          = conti
 
+		#Expert (s, a) minibatches: frames from the (weighted) expert sampler if given, else uniform,
+		#own seeded random stream, built ahead by a background thread
+		#(started on the first call of train, which provides sa_real)
+		self.sa_real        = None
+		self.sa_rng         = np.random.RandomState(seed)
+		self.sampler        = sampler
+		self.n_prefetch     = n_prefetch
+		self.expert_batches = None
+
 
 	#-----------------------
 	# Train PPO
@@ -61,20 +76,28 @@ class PPO:
 		mb_old_a_logps, 
 		sa_real
 	):
-		mb_obs         = torch.from_numpy(mb_obs).to(self.device)
-		mb_actions     = torch.from_numpy(mb_actions).to(self.device)
-		mb_cs          = torch.from_numpy(mb_cs).to(self.device)
-		mb_old_values  = torch.from_numpy(mb_old_values).to(self.device)
-		mb_advs        = torch.from_numpy(mb_advs).to(self.device)
-		mb_returns     = torch.from_numpy(mb_returns).to(self.device)
-		mb_old_a_logps = torch.from_numpy(mb_old_a_logps).to(self.device)
+		mb_obs         = torch.as_tensor(mb_obs, device=self.device)
+		mb_actions     = torch.as_tensor(mb_actions, device=self.device)
+		mb_cs          = torch.as_tensor(mb_cs, device=self.device)
+		mb_old_values  = torch.as_tensor(mb_old_values, device=self.device)
+		mb_advs        = torch.as_tensor(mb_advs, device=self.device)
+		mb_returns     = torch.as_tensor(mb_returns, device=self.device)
+		mb_old_a_logps = torch.as_tensor(mb_old_a_logps, device=self.device)
+
+		#Expert batch producer of this sa_real
+		if self.sa_real is not sa_real:
+			if self.expert_batches is not None:
+				self.expert_batches.close()
+
+			self.sa_real        = sa_real
+			self.expert_batches = BatchPrefetcher(self.get_expert_batch, self.n_prefetch, self.sa_rng.get_state, self.sa_rng.set_state)
+
+		#(s, a) of the whole rollout, discrete actions one-hot encoded once
+		mb_sa = concat_sa(mb_obs, mb_actions, self.a_dim, self.conti)
 
 		#1. Train PPO
 		for i in range(self.sample_n_epoch):
-			np.random.shuffle(self.rand_idx)
-
-			for j in range(self.sample_n_mb):
-				sample_idx         = self.rand_idx[j*self.sample_mb_size : (j+1)*self.sample_mb_size]
+			for sample_idx in minibatch_indices(self.mb_size, self.sample_mb_size, self.device):
 				sample_obs         = mb_obs[sample_idx]
 				sample_actions     = mb_actions[sample_idx]
 				sample_cs          = mb_cs[sample_idx]
@@ -98,41 +121,33 @@ class PPO:
 				pg_loss2 = -sample_advs * torch.clamp(ratio, 1.0-self.clip_val, 1.0+self.clip_val)
 				self.pg_loss = torch.max(pg_loss1, pg_loss2).mean() - self.ent_weight*self.ent
 
-				#Train actor
-				self.opt_actor.zero_grad()
-				self.pg_loss.backward()
-				nn.utils.clip_grad_norm_(policy_net.parameters(), self.max_grad_norm)
-				self.opt_actor.step()
-
-				#Train critic
-				self.opt_critic.zero_grad()
-				self.v_loss.backward()
-				nn.utils.clip_grad_norm_(value_net.parameters(), self.max_grad_norm)
-				self.opt_critic.step()
+				if self.fused:
+					#Train actor & critic: the two losses touch disjoint parameters,
+					#so one backward of their sum gives the same gradients as two passes
+					self.opt_actor.zero_grad()
+					self.opt_critic.zero_grad()
+					(self.pg_loss + self.v_loss).backward()
+					clip_grad_norms_([list(policy_net.parameters()), list(value_net.parameters())], self.max_grad_norm)
+					self.opt_actor.step()
+					self.opt_critic.step()
+				else:
+					#Train actor
+					self.opt_actor.zero_grad()
+					self.pg_loss.backward()
+					nn.utils.clip_grad_norm_(policy_net.parameters(), self.max_grad_norm)
+					self.opt_actor.step()
+
+					#Train critic
+					self.opt_critic.zero_grad()
+					self.v_loss.backward()
+					nn.utils.clip_grad_norm_(value_net.parameters(), self.max_grad_norm)
+					self.opt_critic.step()
 
 		#2. Train Discriminator
-		np.random.shuffle(self.rand_idx)
+		for sample_idx in minibatch_indices(self.mb_size, self.sample_mb_size, self.device):
+			mb_sa_fake = mb_sa[sample_idx]
 
-		for i in range(self.sample_n_mb):
-			sample_idx     = self.rand_idx[i*self.sample_mb_size : (i+1)*self.sample_mb_size]
-			sample_obs     = mb_obs[sample_idx]
-			sample_actions = mb_actions[sample_idx]
-
-			#Continuous: concat (s, a)
-			if self.conti:
-				mb_sa_fake = torch.cat([sample_obs, sample_actions], 1)
-			
-			#Discrete: concat (s, a_onehot)
-			else:
-				sample_actions_onehot = np.zeros([self.sample_mb_size, self.a_dim], dtype=np.float32)
-
-				for j in range(self.sample_mb_size):
-					sample_actions_onehot[j, sample_actions[j]] = 1
-
-				mb_sa_fake = torch.cat([sample_obs, torch.tensor(sample_actions_onehot, dtype=torch.float32, device=self.device)], 1)
-
-			mb_sa_real = sa_real[np.random.randint(0, sa_real.shape[0], self.sample_mb_size), :]
-			mb_sa_real = torch.tensor(mb_sa_real, dtype=torch.float32, device=self.device)
+			mb_sa_real = self.expert_batches.sample()
 
 			#Adversarial loss
 			self.dis_real = dis_net(mb_sa_real)
@@ -154,9 +169,52 @@ class PPO:
 				self.dis_real.mean().item(), \
 				self.dis_fake.mean().item()
 
+	#-----------------------
+	# Get expert (s, a) batch (pinned & copied asynchronously on CUDA)
+	#-----------------------
+	def get_expert_batch(self):
+		if self.sampler is not None:
+			frames = self.sampler.sample_frames(self.sample_mb_size, rng=self.sa_rng)[1]
+		else:
+			frames = self.sa_rng.randint(0, len(self.sa_real), self.sample_mb_size)
+
+		mb_sa_real = self.sa_real[frames, :]
+		mb_sa_real = torch.as_tensor(np.asarray(mb_sa_real, dtype=np.float32))
+
+		if torch.device(self.device).type == "cuda":
+			mb_sa_real = mb_sa_real.pin_memory()
+
+		return mb_sa_real.to(self.device, non_blocking=True)
+
 	#-----------------------
 	# Learning rate decay
 	#-----------------------
 	def lr_decay(self, it, n_it):
 		linear_lr_decay(self.opt_actor, it, n_it, self.lr)
-		linear_lr_decay(self.opt_critic, it, n_it, self.lr)
\ No newline at end of file
+		linear_lr_decay(self.opt_critic, it, n_it, self.lr)
+
+	#-----------------------
+	# Training state (for checkpoints)
+	#-----------------------
+	def state_dict(self):
+		#optimizers (moments, steps, learning rates), expert batch stream
+		return {
+			"opt_actor": self.opt_actor.state_dict(),
+			"opt_critic": self.opt_critic.state_dict(),
+			"opt_dis": self.opt_dis.state_dict(),
+			"expert": self.sa_rng.get_state() if self.expert_batches is None else self.expert_batches.state_dict()
+		}
+
+	#-----------------------
+	# Restore the training state
+	#-----------------------
+	def load_state_dict(self, state):
+		self.opt_actor.load_state_dict(state["opt_actor"])
+		self.opt_critic.load_state_dict(state["opt_critic"])
+		self.opt_dis.load_state_dict(state["opt_dis"])
+
+		#Expert batches restart right after the last sampled one
+		if self.expert_batches is None:
+			self.sa_rng.set_state(state["expert"])
+		else:
+			self.expert_batches.load_state_dict(state["expert"])
\ No newline at end of file
@@ -0,0 +1,40 @@
+import torch
+
+
+#-----------------------
+# Randomly permuted minibatch indices (on device)
+#-----------------------
+def minibatch_indices(n, mb_size, device="cuda:0"):
+	rand_idx = torch.randperm(n, device=device)
+
+	for i in range(n // mb_size):
+		yield rand_idx[i*mb_size : (i+1)*mb_size]
+
+
+#Preallocated rollout storage, written in place by the runner
+class RolloutBuffer():
+	#-----------------------
+	# Constructor
+	#-----------------------
+	def __init__(self, n_step, n_env, fields, device="cuda:0"):
+		#fields: {name: (shape, dtype)}, stored as (n_step, n_env, *shape)
+		self.n_step = n_step
+		self.n_env  = n_env
+		self.device = device
+		self.names  = list(fields)
+
+		for name, (shape, dtype) in fields.items():
+			setattr(self, name, torch.zeros((n_step, n_env) + tuple(shape), dtype=dtype, device=device))
+
+	#-----------------------
+	# (n_step*n_env, *shape) view of a field
+	#-----------------------
+	def flat(self, name):
+		x = getattr(self, name)
+		return x.view((self.n_step*self.n_env,) + tuple(x.shape[2:]))
+
+	#-----------------------
+	# Minibatch indices over all n_step*n_env samples
+	#-----------------------
+	def minibatches(self, mb_size):
+		return minibatch_indices(self.n_step*self.n_env, mb_size, self.device)
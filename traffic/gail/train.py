@@ -5,10 +5,12 @@ from multi_env import MultiEnv, make_env
 from env_runner import EnvRunner
 from model import PolicyNet, ValueNet, DiscriminatorNet
 from agent import PPO
+from checkpoint import CheckpointManager, rng_state, set_rng_state
 import torch
 import os
 import time
 import traffic_env
+import traj_store
 import numpy as np
 import pickle as pkl
 
@@ -35,26 +37,41 @@ def main():
 	save_step      = 300
 	check_step     = 1000
 	save_dir       = "./save"
+	max_keep       = 3
 	device         = "cuda:0" if torch.cuda.is_available() else "cpu"
 	expert_path    = "../expert_traj.pkl"
+	batched_env    = False
+	double_buffer  = False
+	fast_dist      = True
+	fused_update   = True
+	n_prefetch     = 4
+	expert_seed    = 0
+	sample_by_length = True
+	mode_weights   = None
+	#expert_traj.pkl holds 3 modes in equal contiguous blocks (labels for mode_weights & the per-mode returns)
+	expert_modes   = 3
+	envs_per_worker = 1
 
 	#Load expert trajectories
 	#----------------------------
-	if os.path.exists(expert_path):
-		s_real, a_real = pkl.load(open(expert_path, "rb"))
-		sa_real = []
-
-		for i in range(len(s_real)):
-			sa_real.append(np.concatenate([s_real[i], a_real[i]], 1))
-
-		sa_real = np.concatenate(sa_real, 0)
+	if traj_store.exists(expert_path):
+		store   = traj_store.load(expert_path, n_mode=expert_modes)
+		sa_real = store.data
 	else:
 		print("ERROR: No expert trajectory file found")
 		sys.exit(1)
 
+	#Expert sampler (trajectories weighted by length / mode)
+	#----------------------------
+	sampler = traj_store.TrajectorySampler(store, by_length=sample_by_length, mode_weights=mode_weights)
+
 	#Create multiple environments
 	#----------------------------
-	env   = MultiEnv([make_env(i, rand_seed=int(time.time())) for i in range(n_env)])
+	if batched_env:
+		env   = traffic_env.make_batched(n_env)
+	else:
+		env   = MultiEnv([make_env(i, rand_seed=int(time.time())) for i in range(n_env)], envs_per_worker=envs_per_worker)
+
 	s_dim = traffic_env.s_dim
 	a_dim = traffic_env.a_dim
 	c_dim = 2
@@ -68,12 +85,13 @@ def main():
 		gamma,
 		lamb,
 		device=device, 
-		conti=True
+		conti=True,
+		double_buffer=double_buffer
 	)
 
 	#Create model
 	#----------------------------
-	policy_net = PolicyNet(s_dim, a_dim, c_dim, conti=True).to(device)
+	policy_net = PolicyNet(s_dim, a_dim, c_dim, conti=True, fast=fast_dist).to(device)
 	value_net  = ValueNet(s_dim).to(device)
 	dis_net    = DiscriminatorNet(s_dim+a_dim).to(device)
 	agent      = PPO(
@@ -89,7 +107,11 @@ def main():
 		sample_mb_size, 
 		mb_size,
 		device=device,
-		conti=True
+		conti=True,
+		fused=fused_update,
+		n_prefetch=n_prefetch,
+		seed=expert_seed,
+		sampler=sampler
 	)
 	print(policy_net)
 	print(value_net)
@@ -100,7 +122,21 @@ def main():
 	if not os.path.exists(save_dir):
 		os.mkdir(save_dir)
 
-	if os.path.exists(os.path.join(save_dir, "model.pt")):
+	checkpoints = CheckpointManager(save_dir, max_keep)
+
+	if checkpoints.latest() is not None:
+		#Full training state (optimizers, expert streams, statistics, random states): resume after its iteration
+		print("Loading the training state ... ", end="")
+		state = checkpoints.load(checkpoints.latest())
+		policy_net.load_state_dict(state["PolicyNet"])
+		value_net.load_state_dict(state["ValueNet"])
+		dis_net.load_state_dict(state["DiscriminatorNet"])
+		agent.load_state_dict(state["agent"])
+		runner.load_state_dict(state["runner"])
+		set_rng_state(state["rng"])
+		start_it = state["it"] + 1
+		print("Done.")
+	elif os.path.exists(os.path.join(save_dir, "model.pt")):
 		print("Loading the model ... ", end="")
 		checkpoint = torch.load(os.path.join(save_dir, "model.pt"), map_location=torch.device(device))
 		policy_net.load_state_dict(checkpoint["PolicyNet"])
@@ -164,30 +200,40 @@ def main():
 			print("dis_fake         = {:.3f}".format(dis_fake))
 			print()
 
-		#Save model
+		#Save model & the full training state
 		if it % save_step == 0:
 			print("Saving the model ... ", end="")
-			torch.save({
+			checkpoints.save({
 				"it": it,
 				"PolicyNet": policy_net.state_dict(),
 				"ValueNet": value_net.state_dict(),
 				"DiscriminatorNet": dis_net.state_dict()
-			}, os.path.join(save_dir, "model.pt"))
+			}, "model.pt")
+			checkpoints.save_state({
+				"it": it,
+				"PolicyNet": policy_net.state_dict(),
+				"ValueNet": value_net.state_dict(),
+				"DiscriminatorNet": dis_net.state_dict(),
+				"agent": agent.state_dict(),
+				"runner": runner.state_dict(),
+				"rng": rng_state()
+			}, it)
 			print("Done.")
 			print()
 
 		#Save checkpoint
 		if it % check_step == 0:
 			print("Saving the checkpoint ... ", end="")
-			torch.save({
+			checkpoints.save({
 				"it": it,
 				"PolicyNet": policy_net.state_dict(),
 				"ValueNet": value_net.state_dict(),
 				"DiscriminatorNet": dis_net.state_dict()
-			}, os.path.join(save_dir, "model{:d}.pt".format(it)))
+			}, "model{:d}.pt".format(it))
 			print("Done.")
 			print()
 
+	checkpoints.close()
 	env.close()
 
 
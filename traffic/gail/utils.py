@@ -1,3 +1,8 @@
+import torch
+import inspect
+import torch.nn.functional as F
+
+
 #-----------------------
 # Weight initialization
 #-----------------------
@@ -14,4 +19,51 @@ def linear_lr_decay(opt, it, n_it, initial_lr):
 	lr = initial_lr - (initial_lr * (it / float(n_it)))
 	
 	for param_group in opt.param_groups:
-		param_group['lr'] = lr
\ No newline at end of file
+		param_group['lr'] = lr
+
+#-----------------------
+# Concat (s, a), discrete actions are one-hot encoded
+#-----------------------
+def concat_sa(obs, actions, a_dim, conti=True):
+	if conti:
+		return torch.cat([obs, actions], 1)
+
+	return torch.cat([obs, F.one_hot(actions.long(), a_dim).float()], 1)
+
+#-----------------------
+# Adam optimizer (multi-tensor or fused steps for the fused update, when this torch supports them)
+#-----------------------
+def make_adam(params, lr, device="cuda:0", fused=False):
+	adam_args = inspect.signature(torch.optim.Adam).parameters
+
+	if not fused:
+		return torch.optim.Adam(params, lr)
+
+	if torch.device(device).type == "cuda" and "fused" in adam_args:
+		return torch.optim.Adam(params, lr, fused=True)
+
+	if "foreach" in adam_args:
+		return torch.optim.Adam(params, lr, foreach=True)
+
+	return torch.optim.Adam(params, lr)
+
+#-----------------------
+# Clip the gradient norms of several parameter groups in one pass
+#-----------------------
+def clip_grad_norms_(groups, max_norm):
+	#groups: list of parameter lists, each clipped to its own total norm (as clip_grad_norm_ on each group)
+	grads = [[p.grad for p in params if p.grad is not None] for params in groups]
+
+	#total_norms: (n_group)
+	if hasattr(torch.nn.utils, "get_total_norm"):
+		total_norms = torch.stack([torch.nn.utils.get_total_norm(group) for group in grads])
+	else:
+		total_norms = torch.stack([torch.stack([g.norm() for g in group]).norm() for group in grads])
+
+	clip_coefs = torch.clamp(max_norm / (total_norms + 1e-6), max=1.0)
+
+	for group, clip_coef in zip(grads, clip_coefs.unbind()):
+		for g in group:
+			g.mul_(clip_coef)
+
+	return total_norms
\ No newline at end of file
@@ -0,0 +1,60 @@
+import torch
+
+
+#-----------------------
+# Reverse linear scan
+#-----------------------
+def reverse_scan(x, coef):
+	#Solves y[t] = x[t] + coef[t]*y[t+1] with y[n_step] = 0 for every env at once
+	#x, coef: (n_step, n_env)
+	#Pointer doubling: after the pass with stride d, y[t] holds the sum over [t, t+2d)
+	#and a[t] the product of coef over the same span, so only log2(n_step) passes are needed
+	y = x.clone()
+	a = coef.clone()
+	n_step = len(x)
+	d = 1
+
+	while d < n_step:
+		y[:-d] = y[:-d] + a[:-d]*y[d:]
+		a[:-d] = a[:-d]*a[d:]
+		d *= 2
+
+	return y
+
+#-----------------------
+# Next values & non-terminal masks
+#-----------------------
+def shift_next(values, dones, last_values, last_dones):
+	next_values      = torch.cat([values[1:], last_values[None]], 0)
+	next_nonterminal = 1.0 - torch.cat([dones[1:], last_dones[None]], 0).float()
+	return next_values, next_nonterminal
+
+#-----------------------
+# Compute discounted return
+#-----------------------
+def compute_discounted_return(rewards, dones, last_values, last_dones, gamma=0.99):
+	#rewards    : (n_step, n_env)
+	#dones      : (n_step, n_env)
+	#last_values: (n_env)
+	#last_dones : (n_env)
+	_, next_nonterminal = shift_next(rewards, dones, last_values, last_dones)
+	rewards = rewards.clone()
+	rewards[-1] += gamma * last_values * next_nonterminal[-1]
+
+	return reverse_scan(rewards, gamma*next_nonterminal)
+
+#-----------------------
+# Compute gae
+#-----------------------
+def compute_gae(rewards, values, dones, last_values, last_dones, gamma=0.99, lamb=0.95):
+	#rewards    : (n_step, n_env)
+	#values     : (n_step, n_env)
+	#dones      : (n_step, n_env)
+	#advs       : (n_step, n_env)
+	#last_values: (n_env)
+	#last_dones : (n_env)
+	next_values, next_nonterminal = shift_next(values, dones, last_values, last_dones)
+	delta = rewards + gamma*next_values*next_nonterminal - values
+	advs  = reverse_scan(delta, gamma*lamb*next_nonterminal)
+
+	return advs + values
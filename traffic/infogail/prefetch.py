@@ -0,0 +1,96 @@
+import queue
+import atexit
+import threading
+
+
+#Background batch producer: a thread keeps the next minibatches ready in a bounded queue
+class BatchPrefetcher():
+	#-----------------------
+	# Constructor
+	#-----------------------
+	def __init__(self, make_batch, n_prefetch=4, get_state=None, set_state=None):
+		#make_batch: returns one ready-to-use minibatch (always called from one thread, so its random stream stays ordered)
+		#n_prefetch: minibatches prepared ahead by a background thread (0 = built on sampling)
+		#get_state : returns the random state of make_batch, recorded with each batch
+		#set_state : restores it (checkpoints resume right after the last sampled batch, not the last prefetched one)
+		self.make_batch = make_batch
+		self.n_prefetch = n_prefetch
+		self.get_state  = get_state
+		self.set_state  = set_state
+		self.state      = get_state() if get_state is not None else None
+		self.queue      = None
+
+		#Background producer (stopped before interpreter shutdown)
+		if n_prefetch > 0:
+			self.start()
+			atexit.register(self.close)
+
+	#-----------------------
+	# Start the background producer
+	#-----------------------
+	def start(self):
+		self.queue   = queue.Queue(maxsize=self.n_prefetch)
+		self.stopped = threading.Event()
+		self.thread  = threading.Thread(target=self.produce, daemon=True)
+		self.thread.start()
+
+	#-----------------------
+	# Build a minibatch & the random state after it
+	#-----------------------
+	def next_batch(self):
+		batch = self.make_batch()
+		state = self.get_state() if self.get_state is not None else None
+
+		return batch, state
+
+	#-----------------------
+	# Background producer loop
+	#-----------------------
+	def produce(self):
+		while not self.stopped.is_set():
+			item = self.next_batch()
+
+			while not self.stopped.is_set():
+				try:
+					self.queue.put(item, timeout=0.1)
+					break
+				except queue.Full:
+					pass
+
+	#-----------------------
+	# Stop the background producer
+	#-----------------------
+	def close(self):
+		if self.queue is not None:
+			self.stopped.set()
+			self.thread.join()
+			self.queue = None
+
+	#-----------------------
+	# Sample a minibatch
+	#-----------------------
+	def sample(self):
+		if self.queue is not None:
+			batch, self.state = self.queue.get()
+		else:
+			batch, self.state = self.next_batch()
+
+		return batch
+
+	#-----------------------
+	# Random state after the last sampled batch
+	#-----------------------
+	def state_dict(self):
+		return self.state
+
+	#-----------------------
+	# Restore it (prefetched batches are dropped & rebuilt)
+	#-----------------------
+	def load_state_dict(self, state):
+		running = self.queue is not None
+		self.close()
+		self.set_state(state)
+		self.state = state
+
+		if running:
+			self.start()
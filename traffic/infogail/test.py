@@ -7,6 +7,7 @@ from tqdm import tqdm
 import torch
 import os
 import traffic_env
+import traj_store
 import argparse
 import numpy as np
 import pickle as pkl
@@ -32,11 +33,7 @@ def main():
 	#Load expert trajectories
 	#----------------------------
 	if os.path.exists(expert_path):
-		s_real, a_real = pkl.load(open(expert_path, "rb"))
-		sa_real = []
-
-		for i in range(len(s_real)):
-			sa_real.append(np.concatenate([s_real[i], a_real[i]], 1))
+		sa_real = traj_store.load(expert_path)
 	else:
 		print("ERROR: No expert trajectory file found")
 		sys.exit(1)
@@ -0,0 +1,181 @@
+import os
+import re
+import queue
+import atexit
+import inspect
+import random
+import threading
+import torch
+import numpy as np
+
+
+#-----------------------
+# Copy a (nested) state to host memory
+#-----------------------
+def to_cpu(state):
+	if torch.is_tensor(state):
+		return state.detach().to("cpu", copy=True)
+	elif isinstance(state, np.ndarray):
+		return state.copy()
+	elif isinstance(state, dict):
+		return {k: to_cpu(v) for k, v in state.items()}
+	elif isinstance(state, list):
+		return [to_cpu(v) for v in state]
+	elif isinstance(state, tuple):
+		return tuple(to_cpu(v) for v in state)
+
+	return state
+
+#-----------------------
+# Global random states (python, numpy, torch, all CUDA devices)
+#-----------------------
+def rng_state():
+	return {
+		"python": random.getstate(),
+		"numpy": np.random.get_state(),
+		"torch": torch.get_rng_state(),
+		"cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else []
+	}
+
+def set_rng_state(state):
+	random.setstate(state["python"])
+	np.random.set_state(state["numpy"])
+	torch.set_rng_state(state["torch"])
+
+	if torch.cuda.is_available() and len(state["cuda"]) > 0:
+		torch.cuda.set_rng_state_all(state["cuda"])
+
+
+#Checkpoint writer: states are snapshotted to host memory on the caller's thread,
+#then serialized by a background thread (temporary file + atomic rename)
+class CheckpointManager():
+	#-----------------------
+	# Constructor
+	#-----------------------
+	def __init__(self, save_dir, max_keep=3, prefix="state"):
+		#max_keep: rotated full states kept on disk (older ones are removed, 0 = keep all)
+		self.save_dir = save_dir
+		self.max_keep = max_keep
+		self.prefix   = prefix
+		self.pattern  = re.compile(r"^{}(\d+)\.pt$".format(re.escape(prefix)))
+		self.kept     = self.list_states()
+		self.error    = None
+
+		#Background writer (pending writes are finished before interpreter shutdown)
+		self.queue  = queue.Queue(maxsize=2)
+		self.thread = threading.Thread(target=self.write_loop, daemon=True)
+		self.thread.start()
+		atexit.register(self.close)
+
+	#-----------------------
+	# Rotated states on disk, oldest first
+	#-----------------------
+	def list_states(self):
+		if not os.path.exists(self.save_dir):
+			return []
+
+		its = [self.pattern.match(f) for f in os.listdir(self.save_dir)]
+		its = sorted(int(m.group(1)) for m in its if m is not None)
+
+		return [self.state_path(it) for it in its]
+
+	#-----------------------
+	# Path of the rotated state of an iteration
+	#-----------------------
+	def state_path(self, it):
+		return os.path.join(self.save_dir, "{}{:d}.pt".format(self.prefix, it))
+
+	#-----------------------
+	# Latest rotated state (None if there is none)
+	#-----------------------
+	def latest(self):
+		paths = self.list_states()
+
+		return paths[-1] if len(paths) > 0 else None
+
+	#-----------------------
+	# Load a state (to host memory)
+	#-----------------------
+	def load(self, path):
+		#Full states hold numpy random states, so they are not weights-only files
+		#(torch < 1.13 has no weights_only argument and always loads full pickles)
+		if "weights_only" in inspect.signature(torch.load).parameters:
+			return torch.load(path, map_location="cpu", weights_only=False)
+
+		return torch.load(path, map_location="cpu")
+
+	#-----------------------
+	# Save a state to a file (returns once it is snapshotted)
+	#-----------------------
+	def save(self, state, filename):
+		self.check()
+		self.queue.put((to_cpu(state), os.path.join(self.save_dir, filename), False))
+
+	#-----------------------
+	# Save a rotated full state of an iteration
+	#-----------------------
+	def save_state(self, state, it):
+		self.check()
+		self.queue.put((to_cpu(state), self.state_path(it), True))
+
+	#-----------------------
+	# Background writer loop
+	#-----------------------
+	def write_loop(self):
+		while True:
+			item = self.queue.get()
+
+			if item is None:
+				self.queue.task_done()
+				break
+
+			state, path, rotate = item
+
+			try:
+				torch.save(state, path + ".tmp")
+				os.replace(path + ".tmp", path)
+
+				if rotate:
+					self.rotate(path)
+			except Exception as e:
+				self.error = e
+
+			self.queue.task_done()
+
+	#-----------------------
+	# Remove the oldest rotated states
+	#-----------------------
+	def rotate(self, path):
+		if path not in self.kept:
+			self.kept.append(path)
+
+		while self.max_keep > 0 and len(self.kept) > self.max_keep:
+			old = self.kept.pop(0)
+
+			if os.path.exists(old):
+				os.remove(old)
+
+	#-----------------------
+	# Raise a failed background write
+	#-----------------------
+	def check(self):
+		if self.error is not None:
+			error, self.error = self.error, None
+			raise error
+
+	#-----------------------
+	# Wait for the pending writes
+	#-----------------------
+	def wait(self):
+		self.queue.join()
+		self.check()
+
+	#-----------------------
+	# Finish the pending writes & stop the writer
+	#-----------------------
+	def close(self):
+		if self.thread.is_alive():
+			self.queue.put(None)
+			self.thread.join()
+
+		self.check()
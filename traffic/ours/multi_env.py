@@ -15,33 +15,90 @@ def make_env(rank, rand_seed=0, max_step=128):
 		#env.seed(rand_seed + rank)
 		return env
 
+	#A worker owning several of these builds one batched env instead
+	_thunk.make_batched = lambda n_env: traffic_env.make_batched(n_env, max_step)
+
 	return _thunk
 
+#-----------------------
+# Environments owned by one worker
+#-----------------------
+def make_worker_env(env_fns):
+	#Vectorised: all thunks know how to build a batched env (auto-resets on its own)
+	if len(env_fns) > 1 and all(hasattr(env_fn, "make_batched") for env_fn in env_fns):
+		return env_fns[0].make_batched(len(env_fns))
+
+	return SerialEnv(env_fns)
+
 #-----------------------
 # Worker
 #-----------------------
 def worker(remote, parent_remote, env_fn_wrapper):
 	parent_remote.close()
-	env = env_fn_wrapper.x()
+	env = make_worker_env(env_fn_wrapper.x)
 
 	while True:
 		cmd, data = remote.recv()
 
 		if cmd == "step":
-			ob, reward, done, info = env.step(data)
-			if done:
-				ob = env.reset()
+			remote.send(env.step(data))
+
+		elif cmd == "reset":
+			remote.send(env.reset())
+
+		elif cmd == "render":
+			env.render(data)
+
+		elif cmd == "close":
+			remote.close()
+			break
+
+		else:
+			raise NotImplementedError
+
+#-----------------------
+# Shared memory views
+#-----------------------
+def shared_views(buf, n_env, s_dim, a_dim):
+	#obs    : (n_env, s_dim)
+	#actions: (n_env, a_dim)
+	#rewards: (n_env)
+	#dones  : (n_env)
+	obs     = np.ndarray((n_env, s_dim), dtype=np.float32, buffer=buf, offset=0)
+	actions = np.ndarray((n_env, a_dim), dtype=np.float32, buffer=buf, offset=obs.nbytes)
+	rewards = np.ndarray((n_env), dtype=np.float32, buffer=buf, offset=obs.nbytes+actions.nbytes)
+	dones   = np.ndarray((n_env), dtype=np.bool_, buffer=buf, offset=obs.nbytes+actions.nbytes+rewards.nbytes)
+
+	return obs, actions, rewards, dones
+
+#-----------------------
+# Worker (shared memory transport)
+#-----------------------
+def shm_worker(remote, parent_remote, env_fn_wrapper, shm, start, end, n_env, s_dim, a_dim):
+	parent_remote.close()
+	env = make_worker_env(env_fn_wrapper.x)
+	obs, actions, rewards, dones = shared_views(shm.buf, n_env, s_dim, a_dim)
 
-			remote.send((ob, reward, done, info))
+	while True:
+		cmd, data = remote.recv()
+
+		if cmd == "step":
+			ob, reward, done, info = env.step(np.copy(actions[start:end]))
+			obs[start:end]     = ob
+			rewards[start:end] = reward
+			dones[start:end]   = done
+			remote.send(info)
 
 		elif cmd == "reset":
-			ob = env.reset()
-			remote.send(ob)
+			obs[start:end] = env.reset()
+			remote.send(None)
 
 		elif cmd == "render":
-			env.render()
+			env.render(data)
 
 		elif cmd == "close":
+			del obs, actions, rewards, dones
+			shm.close()
 			remote.close()
 			break
 
@@ -49,6 +106,36 @@ def worker(remote, parent_remote, env_fn_wrapper):
 			raise NotImplementedError
 
 
+#Steps a list of environments in a loop
+class SerialEnv():
+	def __init__(self, env_fns):
+		self.envs = [env_fn() for env_fn in env_fns]
+
+	def step(self, actions):
+		results = []
+
+		for env, action in zip(self.envs, actions):
+			ob, reward, done, info = env.step(action)
+			if done:
+				ob = env.reset()
+
+			results.append((ob, reward, done, info))
+
+		obs, rewards, dones, infos = zip(*results)
+
+		return np.stack(obs), np.stack(rewards), np.stack(dones), infos
+
+	def reset(self):
+		return np.stack([env.reset() for env in self.envs])
+
+	def render(self, idx=0):
+		self.envs[idx].render()
+
+	def close(self):
+		for env in self.envs:
+			env.close()
+
+
 #To serialize contents (otherwise multiprocessing tries to use pickle)
 class CloudpickleWrapper():
 	def __init__(self, x):
@@ -68,12 +155,32 @@ class MultiEnv():
 	#-----------------------
 	# Constructor
 	#-----------------------
-	def __init__(self, env_fns):
-		self.closed = False
-		self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(len(env_fns))])
-		self.subprocs = [Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
-						for (work_remote, remote, env_fn) in zip(self.work_remotes, self.remotes, env_fns)]
-		self.n_env = len(self.remotes)
+	def __init__(self, env_fns, shared_memory=False, s_dim=None, a_dim=None, envs_per_worker=1):
+		self.closed   = False
+		self.shm      = None
+		self.n_env    = len(env_fns)
+		self.envs_per_worker = envs_per_worker
+
+		#Worker i owns environments offsets[i]:offsets[i+1]
+		self.offsets  = list(range(0, self.n_env, envs_per_worker)) + [self.n_env]
+		self.n_worker = len(self.offsets) - 1
+		env_fns       = [env_fns[start:end] for start, end in zip(self.offsets[:-1], self.offsets[1:])]
+		self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(self.n_worker)])
+
+		#Shared memory: workers write (ob, reward, done) in place, pipes only carry wake-ups
+		if shared_memory:
+			if s_dim is None or a_dim is None:
+				raise ValueError("s_dim and a_dim are required for the shared memory transport")
+
+			from multiprocessing import shared_memory as shm_lib
+			n_byte   = self.n_env * (4*s_dim + 4*a_dim + 4 + 1)
+			self.shm = shm_lib.SharedMemory(create=True, size=n_byte)
+			self.shm_obs, self.shm_actions, self.shm_rewards, self.shm_dones = shared_views(self.shm.buf, self.n_env, s_dim, a_dim)
+			self.subprocs = [Process(target=shm_worker, args=(work_remote, remote, CloudpickleWrapper(env_fn), self.shm, start, end, self.n_env, s_dim, a_dim))
+							for (work_remote, remote, env_fn, start, end) in zip(self.work_remotes, self.remotes, env_fns, self.offsets[:-1], self.offsets[1:])]
+		else:
+			self.subprocs = [Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
+							for (work_remote, remote, env_fn) in zip(self.work_remotes, self.remotes, env_fns)]
 
 		#Start subprocesses
 		for p in self.subprocs:
@@ -87,13 +194,65 @@ class MultiEnv():
 	# Step
 	#-----------------------
 	def step(self, actions):
-		for remote, action in zip(self.remotes, actions):
-			remote.send(("step", action))
+		self.step_async(actions)
+		return self.step_wait()
+
+	#-----------------------
+	# Send actions to a group of environments without waiting
+	#-----------------------
+	def step_async(self, actions, ranks=slice(None)):
+		workers = self.worker_slice(ranks)
+
+		if self.shm is not None:
+			self.shm_actions[ranks] = actions
+
+			for remote in self.remotes[workers]:
+				remote.send(("step", None))
+		else:
+			base = self.offsets[workers.start]
+
+			for remote, start, end in zip(self.remotes[workers], self.offsets[workers], self.offsets[workers.start+1:workers.stop+1]):
+				remote.send(("step", actions[start-base:end-base]))
 
-		results = [remote.recv() for remote in self.remotes]
+	#-----------------------
+	# Wait for the results of step_async
+	#-----------------------
+	def step_wait(self, ranks=slice(None)):
+		#Shared memory: the returned arrays are overwritten by the next step/reset
+		workers = self.worker_slice(ranks)
+
+		if self.shm is not None:
+			infos = sum([tuple(remote.recv()) for remote in self.remotes[workers]], ())
+
+			return self.shm_obs[ranks], self.shm_rewards[ranks], self.shm_dones[ranks], infos
+
+		#One contiguous block per worker
+		results = [remote.recv() for remote in self.remotes[workers]]
 		obs, rewards, dones, infos = zip(*results)
 
-		return np.stack(obs), np.stack(rewards), np.stack(dones), infos
+		return np.concatenate(obs), np.concatenate(rewards), np.concatenate(dones), sum([tuple(info) for info in infos], ())
+
+	#-----------------------
+	# Map a slice of environments to the workers owning them
+	#-----------------------
+	def worker_slice(self, ranks):
+		envs = range(self.n_env)[ranks]
+
+		if envs.step != 1 or envs.start not in self.offsets or envs.stop not in self.offsets:
+			raise ValueError("env slice {} does not align with workers of {} envs".format(ranks, self.envs_per_worker))
+
+		return slice(self.offsets.index(envs.start), self.offsets.index(envs.stop))
+
+	#-----------------------
+	# Split the environments into groups of whole workers
+	#-----------------------
+	def split(self, n_group):
+		if n_group > self.n_worker:
+			raise ValueError("cannot split {} workers into {} groups".format(self.n_worker, n_group))
+
+		bounds = [self.offsets[self.n_worker * i // n_group] for i in range(n_group + 1)]
+
+		return [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
 
 	#-----------------------
 	# Reset
@@ -102,13 +261,20 @@ class MultiEnv():
 		for remote in self.remotes:
 			remote.send(("reset", None))
 
-		return np.stack([remote.recv() for remote in self.remotes])
+		if self.shm is not None:
+			for remote in self.remotes:
+				remote.recv()
+
+			return np.copy(self.shm_obs)
+
+		return np.concatenate([remote.recv() for remote in self.remotes])
 
 	#-----------------------
 	# Render
 	#-----------------------
 	def render(self, rank=0):
-		self.remotes[rank].send(("render", None))
+		worker = rank // self.envs_per_worker
+		self.remotes[worker].send(("render", rank - self.offsets[worker]))
 
 	#-----------------------
 	# Close
@@ -123,4 +289,9 @@ class MultiEnv():
 		for p in self.subprocs:
 			p.join()
 
+		if self.shm is not None:
+			del self.shm_obs, self.shm_actions, self.shm_rewards, self.shm_dones
+			self.shm.close()
+			self.shm.unlink()
+
 		self.closed = True
\ No newline at end of file
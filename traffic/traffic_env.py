@@ -1,7 +1,6 @@
 import math
 import numpy as np
 import pickle as pkl
-from matplotlib import pyplot as plt
 
 s_dim = 10
 a_dim = 2
@@ -10,7 +9,7 @@ class TrafficEnv():
 	#-------------------------
 	# Constructor
 	#-------------------------
-	def __init__(self, speed=0.02, sigma1=0.008, sigma2=0.001, max_step=80):
+	def __init__(self, speed=0.02, sigma1=0.008, sigma2=0.001, max_step=80, headless=False):
 		self.state    = np.zeros((5, 2), dtype=np.float32)
 		self.max_step = max_step
 		self.n_step   = 1
@@ -21,12 +20,10 @@ class TrafficEnv():
 		self.xs       = []
 		self.ys       = []
 		self.speed    = speed
+		self.headless = headless
+		self.fig      = None
+		self.ax       = None
 
-		self.fig = plt.figure()
-		self.ax  = self.fig.add_subplot(111)
-		mng = plt.get_current_fig_manager()
-		mng.resize(*mng.window.maxsize())
-	
 
 	#-------------------------
 	# Step
@@ -78,10 +75,31 @@ class TrafficEnv():
 		return np.copy(self.state.flatten())
 
 
+	#-------------------------
+	# Create the figure (first render only)
+	#-------------------------
+	def init_render(self):
+		from matplotlib import pyplot as plt
+
+		self.fig = plt.figure()
+		self.ax  = self.fig.add_subplot(111)
+		mng = plt.get_current_fig_manager()
+		mng.resize(*mng.window.maxsize())
+
+
 	#-------------------------
 	# Render
 	#-------------------------
 	def render(self):
+		if self.headless:
+			return
+
+		#Import lazily so that non-rendering workers never load a GUI backend
+		from matplotlib import pyplot as plt
+
+		if self.fig is None:
+			self.init_render()
+
 		self.ax.cla()
 		self.ax.set_aspect(aspect=1.0)
 		self.ax.scatter(self.xs, self.ys, s=4, c=self.color)
@@ -105,8 +123,184 @@ class TrafficEnv():
 		pass
 
 
+#Batch of environments stepped together with array ops
+class BatchedTrafficEnv():
+	#-------------------------
+	# Constructor
+	#-------------------------
+	def __init__(self, n_env, speed=0.02, sigma1=0.008, sigma2=0.001, max_step=80, headless=False):
+		#state : (n_env, 5, 2)
+		#p     : (n_env, 2)
+		#n_step: (n_env)
+		self.n_env    = n_env
+		self.state    = np.zeros((n_env, 5, 2), dtype=np.float32)
+		self.p        = np.zeros((n_env, 2), dtype=np.float64)
+		self.n_step   = np.ones((n_env), dtype=np.int32)
+		self.max_step = max_step
+		self.sigma1   = sigma1
+		self.sigma2   = sigma2
+		self.speed    = speed
+		self.bound    = np.array([1.0, 0.5])
+		self.headless = headless
+		self.pending  = {}
+
+		#Path of the rendered environment
+		self.render_idx = 0
+		self.xs         = []
+		self.ys         = []
+		self.color      = [np.array([1.0, 0.0, 0.0])]
+		self.fig        = None
+		self.ax         = None
+
+
+	#-------------------------
+	# Step (auto-resets finished environments)
+	#-------------------------
+	def step(self, actions):
+		return self.step_group(actions, slice(None))
+
+
+	#-------------------------
+	# Step a group of environments (the result is kept until step_wait)
+	#-------------------------
+	def step_async(self, actions, ranks=slice(None)):
+		self.pending[(ranks.start, ranks.stop, ranks.step)] = self.step_group(actions, ranks)
+
+
+	#-------------------------
+	# Result of step_async
+	#-------------------------
+	def step_wait(self, ranks=slice(None)):
+		return self.pending.pop((ranks.start, ranks.stop, ranks.step))
+
+
+	#-------------------------
+	# Split the environments into contiguous groups
+	#-------------------------
+	def split(self, n_group):
+		if n_group > self.n_env:
+			raise ValueError("cannot split {} envs into {} groups".format(self.n_env, n_group))
+
+		bounds = [self.n_env * i // n_group for i in range(n_group + 1)]
+
+		return [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+	#-------------------------
+	# Step a slice of the environments
+	#-------------------------
+	def step_group(self, actions, ranks):
+		#actions: (n_group, a_dim)
+		envs    = range(self.n_env)[ranks]
+		n       = len(envs)
+		actions = np.array(actions, dtype=np.float64).reshape(n, a_dim)
+		norm    = np.sqrt((actions*actions).sum(1))
+		valid   = norm > 1e-8
+
+		actions[valid]  /= norm[valid, None]
+		actions[~valid]  = [1.0, 0.0]
+
+		self.p[ranks]      += actions * self.speed + self.sigma2*np.random.randn(n, 2)
+		self.n_step[ranks] += 1
+
+		self.state[ranks, :4, :] = self.state[ranks, 1:, :]
+		self.state[ranks, 4, :]  = self.p[ranks]
+
+		if self.render_idx in envs:
+			self.xs.append(self.p[self.render_idx, 0])
+			self.ys.append(self.p[self.render_idx, 1])
+
+		rewards = np.zeros((n), dtype=np.float64)
+		dones   = (self.n_step[ranks] >= self.max_step) | (np.abs(self.p[ranks]) >= self.bound).any(1)
+		obs     = self.state[ranks].reshape(n, s_dim).copy()
+
+		if dones.any():
+			mask = np.zeros((self.n_env), dtype=bool)
+			mask[ranks] = dones
+			obs[dones]  = self.reset_idx(mask)
+
+		return obs, rewards, dones, (0,)*n
+
+
+	#-------------------------
+	# Reset
+	#-------------------------
+	def reset(self):
+		return self.reset_idx(np.ones((self.n_env), dtype=bool))
+
+
+	#-------------------------
+	# Reset selected environments
+	#-------------------------
+	def reset_idx(self, mask):
+		#mask: (n_env) bool
+		n = int(mask.sum())
+		self.p[mask]      = self.sigma1 * np.random.randn(n, 2)
+		self.n_step[mask] = 1
+		self.state[mask]  = self.p[mask, None, :]
+
+		if mask[self.render_idx]:
+			self.xs = [self.p[self.render_idx, 0]]
+			self.ys = [self.p[self.render_idx, 1]]
+
+		return self.state[mask].reshape(n, s_dim).copy()
+
+
+	#-------------------------
+	# Create the figure (first render only)
+	#-------------------------
+	def init_render(self):
+		from matplotlib import pyplot as plt
+
+		self.fig = plt.figure()
+		self.ax  = self.fig.add_subplot(111)
+		mng = plt.get_current_fig_manager()
+		mng.resize(*mng.window.maxsize())
+
+
+	#-------------------------
+	# Render the path of one environment (from its current position when switching)
+	#-------------------------
+	def render(self, idx=0):
+		if self.headless:
+			return
+
+		#Import lazily so that non-rendering workers never load a GUI backend
+		from matplotlib import pyplot as plt
+
+		if idx != self.render_idx:
+			self.render_idx = idx
+			self.xs = [self.p[idx, 0]]
+			self.ys = [self.p[idx, 1]]
+
+		if self.fig is None:
+			self.init_render()
+
+		self.ax.cla()
+		self.ax.set_aspect(aspect=1.0)
+		self.ax.scatter(self.xs, self.ys, s=4, c=self.color)
+		plt.grid()
+		plt.xlim(0, 1)
+		plt.ylim(-0.5, 0.5)
+		plt.pause(0.002)
+
+
+	#-------------------------
+	# Close the environment
+	#-------------------------
+	def close(self):
+		pass
+
+
 #-------------------------
 # Make an environment
 #-------------------------
-def make(max_step=128):
-	return TrafficEnv(max_step=max_step)
\ No newline at end of file
+def make(max_step=128, headless=False):
+	return TrafficEnv(max_step=max_step, headless=headless)
+
+
+#-------------------------
+# Make a batch of environments
+#-------------------------
+def make_batched(n_env, max_step=128):
+	return BatchedTrafficEnv(n_env, max_step=max_step)
\ No newline at end of file